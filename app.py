@@ -1,46 +1,185 @@
 # app.py
 from flask import Flask, render_template, request, redirect, url_for, session, flash
-from flask import send_file, jsonify, make_response
+from flask import send_file, jsonify, make_response, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from functools import wraps
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
-from itsdangerous import URLSafeTimedSerializer
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import razorpay
+import click
+import csv
+from itsdangerous import BadSignature, URLSafeSerializer, URLSafeTimedSerializer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.schema import CreateIndex
+import bisect
+import difflib
+import hashlib
 import io
+import json
 import os
-try:
-    from twilio.rest import Client
-except Exception:
-    Client = None
-try:
-    import qrcode
-except ImportError:
-    qrcode = None
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+# Database engine. DATABASE_URL may point at SQLite (the default) or a server database;
+# SQLite connections are tuned for several gunicorn workers sharing one file.
+SQLITE_TUNING = os.environ.get('SQLITE_TUNING', '1') != '0'
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_POOL_RECYCLE_SECONDS = int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800))
+DB_LOCKED_RETRY_AFTER_SECONDS = 2
+# Read-only analytics views query DATABASE_READ_URL (a replica) when it is set, or a
+# read-only connection to the same SQLite file under WAL. They go back to the primary
+# while the replica is unreachable or more than READ_REPLICA_MAX_LAG_SECONDS behind.
+READ_REPLICA_MAX_LAG_SECONDS = float(os.environ.get('READ_REPLICA_MAX_LAG_SECONDS', 30))
+READ_REPLICA_CHECK_SECONDS = float(os.environ.get('READ_REPLICA_CHECK_SECONDS', 5))
+
+def database_uri():
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
+    # Hosting platforms still hand out postgres:// URLs, which SQLAlchemy no longer accepts
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+def read_database_uri(uri):
+    """Returns the URI analytics reads should use, or None to keep them on the primary."""
+    if os.environ.get('DATABASE_READ_URL'):
+        return os.environ['DATABASE_READ_URL']
+    url = make_url(uri)
+    # Without WAL a reader blocks writers, so a second SQLite connection would not help
+    if url.get_backend_name() != 'sqlite' or not SQLITE_TUNING or url.database in (None, '', ':memory:'):
+        return None
+    database = url.database if url.query.get('uri') else 'file:' + url.database
+    return url.set(database=database).update_query_dict({'mode': 'ro', 'uri': 'true'}).render_as_string(hide_password=False)
+
+def database_engine_options(uri):
+    """Engine options for the configured database. SQLite tuning happens per connection
+    in _tune_sqlite_connection; server databases get a pre-pinged, recycled pool."""
+    if uri.startswith('sqlite'):
+        return {}
+    return {'pool_pre_ping': True, 'pool_size': DB_POOL_SIZE, 'pool_recycle': DB_POOL_RECYCLE_SECONDS}
+
+@event.listens_for(Engine, 'connect')
+def _tune_sqlite_connection(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the single writer; busy_timeout makes a writer wait
+    for the lock instead of failing with "database is locked"."""
+    if not SQLITE_TUNING or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    # Read-only connections cannot change the journal mode; the primary has already set it
+    if cursor.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+        cursor.execute('PRAGMA journal_mode = WAL')
+    # Safe under WAL: a power loss can drop the last commits but never corrupts the file
+    cursor.execute('PRAGMA synchronous = NORMAL')
+    cursor.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    cursor.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+    cursor.execute('PRAGMA temp_store = MEMORY')
+    cursor.close()
+
+class RoutingSession(FlaskSession):
+    """Sends SELECTs to the read engine while session.info['read_only'] is set (see
+    read_replica); writes, flushes and raw SQL always go to the primary."""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only') and not self._flushing and getattr(clause, 'is_select', False):
+            engine = read_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
 app = Flask(__name__, template_folder='templates')
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'a-default-fallback-secret-key-for-dev')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
+READ_DATABASE_URI = read_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+if READ_DATABASE_URI:
+    app.config['SQLALCHEMY_BINDS'] = {'read': READ_DATABASE_URI}
 
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
 
 # Razorpay Configuration
 RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID')
 RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET')
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
 
 UPI_ID = os.environ.get('UPI_ID', 'merchant@upi')
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
 TWILIO_FROM_NUMBER = os.environ.get('TWILIO_FROM_NUMBER')
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN) if Client and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN else None
+
+class LazyProvider:
+    """Builds an integration (client or optional module) on first use and reuses it.
+    Keeps heavy third-party imports out of worker startup. The factory may return None
+    when the integration is not installed or not configured."""
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._factory()
+                    self._loaded = True
+        return self._value
+
+def _make_razorpay_client():
+    import razorpay
+    return razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+
+def _make_twilio_client():
+    if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
+        return None
+    try:
+        from twilio.rest import Client
+    except Exception:
+        return None
+    return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+
+def _load_qrcode():
+    try:
+        import qrcode
+        import qrcode.image.svg  # noqa: F401
+    except ImportError:
+        return None
+    return qrcode
+
+def _load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def _load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return None
+    return pyarrow
+
+razorpay_client = LazyProvider(_make_razorpay_client)
+twilio_client = LazyProvider(_make_twilio_client)
+qrcode_module = LazyProvider(_load_qrcode)
+numpy_module = LazyProvider(_load_numpy)
+pyarrow_module = LazyProvider(_load_pyarrow)
 
 # Delivery & Logistics Defaults
 DEFAULT_SHIPPING_FEE = 60
@@ -48,6 +187,71 @@ DEFAULT_FREE_SHIPPING_THRESHOLD = 600
 DEFAULT_DELIVERY_PARTNER_COST = 45
 DEFAULT_COMMISSION_RATE = 0.10
 
+# Delivery pricing slabs as (max_km, fee, cost); max_km None is the open-ended top slab
+DEFAULT_DELIVERY_SLABS = [(5, 40, 30), (15, 60, 40), (30, 90, 55), (None, 150, 100)]
+MAX_BULK_QUOTES = 10000
+CART_SUMMARY_TTL_SECONDS = 60  # bounds staleness from seller price edits; cart edits invalidate immediately
+CART_SUMMARY_CACHE_SIZE = 1024
+MAX_CART_BATCH_LINES = 200
+
+# Site settings are cached per process. Saving them bumps a version row, which
+# other workers compare against at most every SITE_SETTINGS_RECHECK_SECONDS.
+SITE_SETTINGS_VERSION_KEY = '_settings_version'
+SITE_SETTINGS_RECHECK_SECONDS = float(os.environ.get('SITE_SETTINGS_RECHECK_SECONDS', 5))
+
+# Notification outbox: 'thread' dispatches from a background thread in each web
+# worker, 'worker' leaves it to `flask run-notification-worker`.
+NOTIFICATION_DISPATCHER = os.environ.get('NOTIFICATION_DISPATCHER', 'thread')
+NOTIFICATION_TRANSPORT = os.environ.get('NOTIFICATION_TRANSPORT', 'live')  # 'live' or 'fake'
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', 5))
+NOTIFICATION_RETRY_BASE_SECONDS = 30
+NOTIFICATION_BATCH_SIZE = 50
+NOTIFICATION_CLAIM_SECONDS = 300
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 2))
+SMTP_MAX_IDLE_SECONDS = 60  # servers drop idle sessions; reconnect rather than risk a dead socket
+SMTP_MAX_MESSAGES_PER_CONNECTION = 100
+
+# Promotion campaigns stream users in keyset chunks and fan out to rate-limited
+# sender threads (one SMTP session per thread by default).
+PROMOTION_CHUNK_SIZE = 500
+PROMOTION_SEND_BATCH = 50
+PROMOTION_WORKERS = int(os.environ.get('PROMOTION_WORKERS', SMTP_POOL_SIZE))
+PROMOTION_SMS_PER_SECOND = float(os.environ.get('PROMOTION_SMS_PER_SECOND', 10))
+PROMOTION_EMAILS_PER_SECOND = float(os.environ.get('PROMOTION_EMAILS_PER_SECOND', 20))
+# A running campaign whose runner has not checked in for this long (e.g. its web
+# worker was recycled) is re-queued and resumed from its cursor by another process.
+PROMOTION_STALE_SECONDS = int(os.environ.get('PROMOTION_STALE_SECONDS', 300))
+PROMOTION_RESUME_CHECK_SECONDS = 60  # how often each dispatcher looks for campaigns to pick up
+PROMOTION_AUDIENCES = {'all': ('buyer', 'seller', 'farmer'), 'buyer': ('buyer',), 'seller': ('seller', 'farmer')}
+
+# Report exports stream this many rows per chunk
+EXPORT_CHUNK_SIZE = 1000
+DEFAULT_ORDER_EXPORT_COLUMNS = ['order_id', 'buyer_id', 'total_amount', 'status', 'created_at']
+EXPORT_FORMATS = ('csv', 'ndjson', 'parquet')  # parquet needs pyarrow; ndjson is gzip-compressed
+EXPORT_SPOOL_BYTES = 32 * 1024 * 1024  # Parquet exports larger than this are buffered on disk
+
+# List pages use keyset pagination; their "about N results" totals are cached COUNTs
+PAGE_TOTAL_TTL_SECONDS = 60
+PAGE_TOTAL_CACHE_SIZE = 256
+
+# Rendered UPI QR codes kept in memory, keyed by payload and format
+UPI_QR_CACHE_SIZE = 256
+UPI_QR_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# How long checkout holds stock for a buyer before releasing it
+STOCK_HOLD_MINUTES = int(os.environ.get('STOCK_HOLD_MINUTES', 10))
+
+# Seller dashboard chart ranges, in days
+SELLER_DASHBOARD_RANGES = (7, 30, 90)
+
+# Admin panel defaults
+LOW_STOCK_THRESHOLD = 5
+ADMIN_STATS_TTL_SECONDS = int(os.environ.get('ADMIN_STATS_TTL_SECONDS', 30))
+
+# Category groups used by the dashboard charts
+PRODUCE_CATEGORIES = ['fruits', 'vegetables', 'grains', 'dairy']
+SUPPLIES_CATEGORIES = ['seeds', 'fertilizers', 'pesticides', 'tools', 'machinery']
+
 # Database Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -60,6 +264,8 @@ class User(db.Model):
     upi_phone_number = db.Column(db.String(20), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_approved = db.Column(db.Boolean, default=True)
+    cart_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # bumped by touch_cart()
+    __table_args__ = (db.Index('ix_user_created_at', 'created_at'),)
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -71,6 +277,16 @@ class Product(db.Model):
     image = db.Column(db.String(200))
     seller_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Denormalized review aggregates, maintained when a review is added
+    avg_rating = db.Column(db.Float, nullable=False, default=0.0)
+    review_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    __table_args__ = (
+        db.Index('ix_product_category', 'category'),
+        db.Index('ix_product_category_lower', db.func.lower(category), created_at),
+        db.Index('ix_product_seller_created', 'seller_id', 'created_at'),
+        db.Index('ix_product_created_at', 'created_at'),
+        db.Index('ix_product_price', 'price'),
+    )
 
     # Add relationship to reviews
     reviews = db.relationship('ProductReview', backref='product', lazy='dynamic', cascade="all, delete-orphan")
@@ -86,12 +302,32 @@ class ProductReview(db.Model):
     rating = db.Column(db.Integer, nullable=False)
     review_text = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_product_review_product_created', 'product_id', 'created_at'),
+        db.Index('ix_product_review_buyer_product', 'buyer_id', 'product_id'),
+    )
 
 class Cart(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     buyer_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=1)
+    __table_args__ = (
+        db.Index('ix_cart_buyer_product', 'buyer_id', 'product_id'),
+    )
+
+class StockHold(db.Model):
+    """Stock set aside for a buyer's checkout; returned to the product when it expires."""
+    id = db.Column(db.Integer, primary_key=True)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_stock_hold_buyer', 'buyer_id'),
+        db.Index('ix_stock_hold_expires', 'expires_at'),
+    )
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -105,6 +341,12 @@ class Order(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     delivery_person_id = db.Column(db.Integer, db.ForeignKey('delivery_person.id'), nullable=True)
     delivery_person = db.relationship('DeliveryPerson')
+    __table_args__ = (
+        db.Index('ix_order_buyer_created', 'buyer_id', 'created_at'),
+        db.Index('ix_order_status', 'status'),
+        db.Index('ix_order_created_at', 'created_at'),
+        db.Index('ix_order_delivery_person', 'delivery_person_id', 'created_at'),
+    )
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -112,16 +354,25 @@ class OrderItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='SET NULL'), nullable=True)
     seller_id = db.Column(db.Integer, nullable=True)
     product_name = db.Column(db.String(100), nullable=False) # Snapshot of name
+    category = db.Column(db.String(50), nullable=True) # Snapshot of category, for the sales rollup
     price = db.Column(db.Float, nullable=False) # Snapshot of price
     quantity = db.Column(db.Integer, nullable=False)
     is_paid_to_seller = db.Column(db.Boolean, default=False)
     commission_amount = db.Column(db.Float, default=0.0)
+    __table_args__ = (
+        db.Index('ix_order_item_order', 'order_id'),
+        db.Index('ix_order_item_seller_paid', 'seller_id', 'is_paid_to_seller'),
+        db.Index('ix_order_item_product', 'product_id'),
+    )
 
 class OrderStatusHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id', ondelete='CASCADE'), nullable=False)
     status = db.Column(db.String(50), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_order_status_history_order', 'order_id', 'timestamp'),
+    )
 
 class OrderNote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -132,6 +383,9 @@ class OrderNote(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
     author = db.relationship('User')
+    __table_args__ = (
+        db.Index('ix_order_note_order_created', 'order_id', 'created_at'),
+    )
 
 class DeliveryPerson(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -155,6 +409,9 @@ class Payout(db.Model):
     commission_total = db.Column(db.Float, default=0.0)
     status = db.Column(db.String(20), default='Completed')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_payout_seller_created', 'seller_id', 'created_at'),
+    )
 
 class Feedback(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -167,111 +424,886 @@ class SiteSetting(db.Model):
     key = db.Column(db.String(50), primary_key=True)
     value = db.Column(db.String(200), nullable=False)
 
-# Create tables
-with app.app_context():
-    db.create_all()
-    try:
-        cols = [r[1] for r in db.session.execute(db.text('PRAGMA table_info(user)')).fetchall()]
-        if 'phone' not in cols:
-            db.session.execute(db.text('ALTER TABLE user ADD COLUMN phone VARCHAR(20)'))
-            db.session.commit()
-    except Exception:
-        pass
-    try:
-        cols = [r[1] for r in db.session.execute(db.text('PRAGMA table_info(user)')).fetchall()]
-        if 'account_number' not in cols:
-            db.session.execute(db.text('ALTER TABLE user ADD COLUMN account_number VARCHAR(50)'))
-        if 'upi_phone_number' not in cols:
-            db.session.execute(db.text('ALTER TABLE user ADD COLUMN upi_phone_number VARCHAR(20)'))
+class OutboxMessage(db.Model):
+    """A queued SMS or email, delivered by the notification dispatcher."""
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(10), nullable=False)  # 'sms' or 'email'
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=True)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = db.Column(db.String(36), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (
+        db.Index('ix_outbox_message_due', 'status', 'next_attempt_at'),
+        db.Index('ix_outbox_message_claim', 'claim_token'),
+    )
+
+class PromotionCampaign(db.Model):
+    """A bulk promotion. last_user_id is the keyset cursor, so an interrupted campaign resumes where it stopped."""
+    id = db.Column(db.Integer, primary_key=True)
+    message = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    channels = db.Column(db.String(20), nullable=False, default='sms,email')
+    audience = db.Column(db.String(20), nullable=False, default='all')
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    total_recipients = db.Column(db.Integer, nullable=True)
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)
+    sent_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # bumped by the runner after each chunk
+
+class SchemaVersion(db.Model):
+    """Single row (id=1) recording the applied migration version and the migration lock."""
+    __tablename__ = 'schema_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    search_index = db.Column(db.Boolean, nullable=False, default=False)  # FTS5 table was created
+    locked_until = db.Column(db.DateTime, nullable=True)
+    applied_at = db.Column(db.DateTime, nullable=True)
+
+class DeliverySlab(db.Model):
+    """A delivery pricing slab: distances up to and including max_km pay this fee.
+    A NULL max_km marks the open-ended top slab."""
+    id = db.Column(db.Integer, primary_key=True)
+    max_km = db.Column(db.Float, nullable=True)
+    fee = db.Column(db.Float, nullable=False)
+    cost = db.Column(db.Float, nullable=False)
+
+class ExportWatermark(db.Model):
+    """Highest row id already delivered to a consumer of an incremental export.
+    Id-based, so incremental exports are append-only (see admin_export_table)."""
+    name = db.Column(db.String(100), primary_key=True)  # '<consumer>:<table>'
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DailySalesRollup(db.Model):
+    """Pre-aggregated sales per day. The 'all' group carries order-level totals,
+    the other groups ('produce', 'supplies', 'other') carry item sales only."""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    category_group = db.Column(db.String(20), nullable=False, default='all')
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    delivery_fee = db.Column(db.Float, nullable=False, default=0.0)
+    delivery_cost = db.Column(db.Float, nullable=False, default=0.0)
+    item_sales = db.Column(db.Float, nullable=False, default=0.0)
+    items_sold = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('day', 'category_group', name='uq_daily_sales_rollup_day_group'),)
+
+# Date bucketing: turn day/week/month/year buckets into half-open datetime ranges
+# (`column >= start AND column < end`) so indexes on timestamp columns stay usable.
+DATE_BUCKETS = ('day', 'week', 'month', 'year')
+
+def day_start(day):
+    """Returns midnight at the start of `day` as a datetime."""
+    return datetime.combine(day, datetime.min.time())
+
+def bucket_start(day, bucket='day'):
+    """Returns the first day of the bucket containing `day` (weeks start on Monday)."""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+def next_bucket(start, bucket='day'):
+    """Returns the first day of the bucket following the one starting at `start`."""
+    if bucket == 'week':
+        return start + timedelta(days=7)
+    if bucket == 'month':
+        return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    if bucket == 'year':
+        return start.replace(year=start.year + 1)
+    return start + timedelta(days=1)
+
+def last_buckets(bucket, count, today):
+    """Returns the start days of the last `count` buckets, oldest first, ending with the one containing `today`."""
+    starts = [bucket_start(today, bucket)]
+    for _ in range(count - 1):
+        starts.insert(0, bucket_start(starts[0] - timedelta(days=1), bucket))
+    return starts
+
+def created_between(column, start_day, end_day):
+    """Sargable predicate for `column` falling on any day from start_day to end_day inclusive.
+    Either bound may be None to leave that side open."""
+    bounds = []
+    if start_day:
+        bounds.append(column >= day_start(start_day))
+    if end_day:
+        bounds.append(column < day_start(end_day + timedelta(days=1)))
+    return db.and_(*bounds) if bounds else db.true()
+
+def _as_date(value):
+    """Normalizes a DATE() result, which SQLite returns as an ISO string."""
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return value
+
+def category_group(category):
+    """Maps a product category onto the dashboard category group."""
+    category = (category or '').lower()
+    if category in PRODUCE_CATEGORIES:
+        return 'produce'
+    if category in SUPPLIES_CATEGORIES:
+        return 'supplies'
+    return 'other'
+
+def _bump_daily_rollup(day, group, **deltas):
+    """Adds deltas to the rollup row for (day, group) with a single upsert, so concurrent
+    checkouts neither overwrite each other nor race to create the day's first row."""
+    table = DailySalesRollup.__table__
+    values = dict(day=day, category_group=group, order_count=0, total_amount=0.0, delivery_fee=0.0,
+                  delivery_cost=0.0, item_sales=0.0, items_sold=0)
+    values.update(deltas)
+    dialect = db.session.get_bind(mapper=DailySalesRollup).dialect.name
+    # Server dialects are imported on demand to keep them out of worker startup
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        statement = mysql_insert(table).values(**values)
+        statement = statement.on_duplicate_key_update({c: table.c[c] + statement.inserted[c] for c in deltas})
+    else:
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert_insert
+        else:
+            upsert_insert = sqlite_insert
+        statement = upsert_insert(table).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.category_group],
+            set_={c: table.c[c] + statement.excluded[c] for c in deltas}
+        )
+    db.session.execute(statement)
+
+def record_order_in_rollup(order, cart_products):
+    """Adds a freshly placed order to the daily sales rollup (caller commits)."""
+    day = (order.created_at or datetime.utcnow()).date()
+    group_totals = {}
+    for item in cart_products:
+        group = category_group(item.get('category'))
+        sales, sold = group_totals.get(group, (0.0, 0))
+        group_totals[group] = (sales + item['price'] * item['quantity'], sold + item['quantity'])
+
+    _bump_daily_rollup(
+        day, 'all',
+        order_count=1,
+        total_amount=order.total_amount or 0.0,
+        delivery_fee=order.delivery_fee or 0.0,
+        delivery_cost=order.delivery_cost or 0.0,
+        item_sales=sum(sales for sales, _ in group_totals.values()),
+        items_sold=sum(sold for _, sold in group_totals.values())
+    )
+    for group, (sales, sold) in group_totals.items():
+        _bump_daily_rollup(day, group, item_sales=sales, items_sold=sold)
+
+def rebuild_daily_sales_rollup(start_day=None, end_day=None):
+    """Recomputes rollup rows from the order tables for an inclusive date range
+    (or everything when no range is given). Caller commits."""
+    order_day = db.func.date(Order.created_at)
+    # The category snapshotted on the item, so deleting a product never moves its past sales;
+    # items from before the snapshot column fall back to the live product
+    item_category = db.func.lower(db.func.coalesce(OrderItem.category, Product.category))
+    group_expr = db.case(
+        (item_category.in_(PRODUCE_CATEGORIES), 'produce'),
+        (item_category.in_(SUPPLIES_CATEGORIES), 'supplies'),
+        else_='other'
+    )
+
+    order_query = db.session.query(
+        order_day,
+        db.func.count(Order.id),
+        db.func.sum(Order.total_amount),
+        db.func.sum(Order.delivery_fee),
+        db.func.sum(Order.delivery_cost)
+    )
+    item_query = db.session.query(
+        order_day,
+        group_expr,
+        db.func.sum(OrderItem.price * OrderItem.quantity),
+        db.func.sum(OrderItem.quantity)
+    ).join(Order, OrderItem.order_id == Order.id)\
+     .outerjoin(Product, OrderItem.product_id == Product.id)
+    rollup_query = DailySalesRollup.query
+
+    if start_day is not None:
+        start_dt = day_start(start_day)
+        order_query = order_query.filter(Order.created_at >= start_dt)
+        item_query = item_query.filter(Order.created_at >= start_dt)
+        rollup_query = rollup_query.filter(DailySalesRollup.day >= start_day)
+    if end_day is not None:
+        end_dt = day_start(end_day + timedelta(days=1))
+        order_query = order_query.filter(Order.created_at < end_dt)
+        item_query = item_query.filter(Order.created_at < end_dt)
+        rollup_query = rollup_query.filter(DailySalesRollup.day <= end_day)
+
+    rollup_query.delete(synchronize_session=False)
+
+    rows = {}
+    for day, count, total, fee, cost in order_query.group_by(order_day).all():
+        rows[(_as_date(day), 'all')] = DailySalesRollup(
+            day=_as_date(day), category_group='all', order_count=count or 0,
+            total_amount=total or 0.0, delivery_fee=fee or 0.0, delivery_cost=cost or 0.0,
+            item_sales=0.0, items_sold=0
+        )
+    for day, group, sales, sold in item_query.group_by(order_day, group_expr).all():
+        day = _as_date(day)
+        all_row = rows.get((day, 'all'))
+        if all_row:
+            all_row.item_sales += sales or 0.0
+            all_row.items_sold += sold or 0
+        rows[(day, group)] = DailySalesRollup(
+            day=day, category_group=group, order_count=0, total_amount=0.0,
+            delivery_fee=0.0, delivery_cost=0.0, item_sales=sales or 0.0, items_sold=sold or 0
+        )
+    db.session.add_all(rows.values())
+    return len(rows)
+
+def get_daily_rollup(start_day, end_day):
+    """Returns rollup rows keyed by (day, category_group) for an inclusive range in one query."""
+    rows = DailySalesRollup.query.filter(
+        DailySalesRollup.day >= start_day,
+        DailySalesRollup.day <= end_day
+    ).all()
+    return {(row.day, row.category_group): row for row in rows}
+
+def rollup_series(rollup, starts, bucket, group, column):
+    """Sums a rollup column into the buckets beginning at `starts`."""
+    totals = dict.fromkeys(starts, 0)
+    for (day, row_group), row in rollup.items():
+        key = bucket_start(day, bucket)
+        if row_group == group and key in totals:
+            totals[key] += getattr(row, column)
+    return [totals[start] for start in starts]
+
+def recompute_product_ratings(product_id=None):
+    """Recomputes avg_rating/review_count from the review table (all products, or one). Caller commits."""
+    review_count = db.select(db.func.count(ProductReview.id))\
+        .where(ProductReview.product_id == Product.id).scalar_subquery()
+    avg_rating = db.select(db.func.coalesce(db.func.avg(ProductReview.rating), 0.0))\
+        .where(ProductReview.product_id == Product.id).scalar_subquery()
+    query = Product.query
+    if product_id is not None:
+        query = query.filter(Product.id == product_id)
+    return query.update({Product.review_count: review_count, Product.avg_rating: avg_rating}, synchronize_session=False)
+
+# Stock reservation. Every decrement is a single conditional UPDATE covering all
+# lines of an order, so concurrent checkouts can never oversell.
+class StockUnavailable(Exception):
+    """Raised when one or more lines cannot be reserved. `short` maps product_id -> available quantity."""
+    def __init__(self, short):
+        super().__init__(f"Insufficient stock for product(s): {', '.join(str(pid) for pid in short)}")
+        self.short = short
+
+def cart_quantities(cart_products):
+    """Collapses cart lines into {product_id: quantity}."""
+    quantities = {}
+    for item in cart_products:
+        quantities[item['id']] = quantities.get(item['id'], 0) + item['quantity']
+    return quantities
+
+def stock_error_message(error, cart_products):
+    names = {item['id']: item['name'] for item in cart_products}
+    parts = [f'"{names.get(pid, pid)}" (only {available} left)' for pid, available in error.short.items()]
+    return 'Not enough stock for ' + ', '.join(parts) + '. Please update your cart.'
+
+def reserve_stock(quantities):
+    """Atomically decrements stock for {product_id: quantity}, all-or-nothing. Caller commits,
+    or rolls back on StockUnavailable."""
+    if not quantities:
+        return
+    ids = list(quantities)
+    requested = db.case(quantities, value=Product.id)
+    other = db.aliased(Product)
+    # The update only applies when every line is satisfiable at statement time
+    satisfiable = db.select(db.func.count(other.id)).where(
+        other.id.in_(ids),
+        other.quantity >= db.case(quantities, value=other.id)
+    ).scalar_subquery()
+    # The per-row check is what a server database re-evaluates after waiting on a row lock
+    # (READ COMMITTED does not recheck the subquery), so a concurrent buyer cannot oversell
+    result = db.session.execute(
+        db.update(Product)
+        .where(Product.id.in_(ids), Product.quantity >= requested, satisfiable == len(ids))
+        .values(quantity=Product.quantity - requested)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(ids):
+        available = dict(db.session.query(Product.id, Product.quantity).filter(Product.id.in_(ids)).all())
+        raise StockUnavailable({
+            pid: max(available.get(pid, 0), 0) for pid, qty in quantities.items() if available.get(pid, 0) < qty
+        })
+
+def _release_holds(condition):
+    """Returns held quantities matching `condition` to their products and drops the holds."""
+    held = db.select(db.func.coalesce(db.func.sum(StockHold.quantity), 0))\
+        .where(StockHold.product_id == Product.id, condition).scalar_subquery()
+    Product.query.filter(Product.id.in_(db.select(StockHold.product_id).where(condition)))\
+        .update({Product.quantity: Product.quantity + held}, synchronize_session=False)
+    return StockHold.query.filter(condition).delete(synchronize_session=False)
+
+def release_expired_holds(product_ids=None):
+    """Releases expired stock holds, on every product or only the given ones. Caller commits."""
+    condition = StockHold.expires_at < datetime.utcnow()
+    if product_ids is not None:
+        condition = db.and_(condition, StockHold.product_id.in_(list(product_ids)))
+    return _release_holds(condition)
+
+def reclaim_expired_stock(product_ids):
+    """Returns stock held by abandoned payments on these products and commits, so a stock
+    check that failed can be retried. Returns whether anything was released."""
+    if release_expired_holds(product_ids):
         db.session.commit()
-    except Exception:
-        pass
-    # Check for is_approved in user table
-    try:
-        cols = [r[1] for r in db.session.execute(db.text('PRAGMA table_info(user)')).fetchall()]
-        if 'is_approved' not in cols:
-            db.session.execute(db.text('ALTER TABLE user ADD COLUMN is_approved BOOLEAN DEFAULT 1'))
-            db.session.commit()
-    except Exception:
-        pass
-    # Check for shipping_address in order table
+        return True
+    return False
+
+def release_buyer_holds(user_id):
+    """Releases all stock held for a buyer. Caller commits."""
+    return _release_holds(StockHold.buyer_id == user_id)
+
+def hold_cart_stock(user_id, cart_products):
+    """Reserves the buyer's cart for STOCK_HOLD_MINUTES, replacing any previous hold. Caller commits."""
+    release_expired_holds()
+    release_buyer_holds(user_id)
+    quantities = cart_quantities(cart_products)
+    if not quantities:
+        return
+    reserve_stock(quantities)
+    expires_at = datetime.utcnow() + timedelta(minutes=STOCK_HOLD_MINUTES)
+    db.session.execute(db.insert(StockHold), [
+        {'buyer_id': user_id, 'product_id': pid, 'quantity': qty, 'expires_at': expires_at}
+        for pid, qty in quantities.items()
+    ])
+
+def commit_order_stock(user_id, cart_products):
+    """Turns the buyer's hold (if still live) into a permanent decrement and removes
+    products that sold out. Raises StockUnavailable; caller rolls back on failure."""
+    release_expired_holds()
+    release_buyer_holds(user_id)
+    quantities = cart_quantities(cart_products)
+    reserve_stock(quantities)
+
+    # A product at zero may still have units held by other buyers; keep it until they check out
+    live_holds = db.select(StockHold.id).where(StockHold.product_id == Product.id).exists()
+    sold_out = Product.query.filter(Product.id.in_(list(quantities)), Product.quantity <= 0, ~live_holds)\
+        .execution_options(populate_existing=True).all()
+    for product in sold_out:
+        app.logger.info(f'Product "{product.name}" (ID: {product.id}) ran out of stock and was deleted.')
+        db.session.delete(product)
+
+# Keyset pagination. A page is addressed by an opaque, signed cursor holding the sort
+# key of the row it continues from, so a deep page is one index range scan instead of
+# an OFFSET scan plus a COUNT(*). The last sort key must be unique (usually the id).
+KeysetPage = namedtuple('KeysetPage', 'items next_cursor prev_cursor total')
+page_cursor_serializer = URLSafeSerializer(app.config['SECRET_KEY'], salt='page-cursor')
+_page_totals = {'counts': OrderedDict(), 'lock': threading.Lock()}
+
+def _encode_page_cursor(direction, values):
+    values = [{'dt': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return page_cursor_serializer.dumps([direction, values])
+
+def _decode_page_cursor(cursor, key_count):
+    """Returns (direction, key values), or (None, None) for a missing or tampered cursor."""
+    if not cursor:
+        return None, None
     try:
-        cols = [r[1] for r in db.session.execute(db.text('PRAGMA table_info("order")')).fetchall()]
-        if 'shipping_address' not in cols:
-            db.session.execute(db.text('ALTER TABLE "order" ADD COLUMN shipping_address TEXT'))
-            db.session.commit()
-    except Exception:
-        pass
-    # Check for delivery_fee and delivery_cost in order table
+        direction, values = page_cursor_serializer.loads(cursor)
+    except (BadSignature, TypeError, ValueError):
+        return None, None
+    if direction not in ('next', 'prev') or not isinstance(values, list) or len(values) != key_count:
+        return None, None
+    return direction, [datetime.fromisoformat(v['dt']) if isinstance(v, dict) else v for v in values]
+
+def _keyset_after(keys, values, backwards):
+    """Rows strictly after `values` in the (column, descending) sort order, or before it when backwards."""
+    values = [db.literal(value, column.type) for (column, _), value in zip(keys, values)]
+    downward = [descending != backwards for _, descending in keys]
+    if all(downward) or not any(downward):
+        # A row-value comparison is planned as an index range; the equivalent OR chain is not
+        columns, bounds = db.tuple_(*[column for column, _ in keys]), db.tuple_(*values)
+        return columns < bounds if downward[0] else columns > bounds
+    clauses = []
+    for i, ((column, _), value) in enumerate(zip(keys, values)):
+        beyond = column < value if downward[i] else column > value
+        clauses.append(db.and_(*[c == v for (c, _), v in zip(keys[:i], values[:i])], beyond))
+    # Mixed directions need the OR chain; bounding the first key still lets its index seek
+    first, bound = keys[0][0], values[0]
+    return db.and_(first <= bound if downward[0] else first >= bound, db.or_(*clauses))
+
+def estimated_count(query):
+    """COUNT of a query's rows, cached for PAGE_TOTAL_TTL_SECONDS per distinct SQL and parameters."""
+    compiled = query.order_by(None).statement.compile()
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    now = time.monotonic()
+    with _page_totals['lock']:
+        cached = _page_totals['counts'].get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+    total = query.order_by(None).count()
+    with _page_totals['lock']:
+        _page_totals['counts'][key] = (total, now + PAGE_TOTAL_TTL_SECONDS)
+        _page_totals['counts'].move_to_end(key)
+        while len(_page_totals['counts']) > PAGE_TOTAL_CACHE_SIZE:
+            _page_totals['counts'].popitem(last=False)
+    return total
+
+def keyset_paginate(query, keys, per_page, cursor=None, with_total=False):
+    """Returns a KeysetPage of `query` ordered by keys, a list of (column, descending) pairs.
+    Key columns must be NOT NULL (a NULL never compares, so rows past it would be skipped);
+    the keyset_sort_keys migration backfills legacy NULL created_at values.
+    Items have the query's own shape; the cursors are None at either end of the list."""
+    direction, values = _decode_page_cursor(cursor, len(keys))
+    backwards = direction == 'prev'
+    width = len(query.column_descriptions)
+    keyed = query.add_columns(*[column.label(f'page_key_{i}') for i, (column, _) in enumerate(keys)])
+    if values is not None:
+        keyed = keyed.filter(_keyset_after(keys, values, backwards))
+    keyed = keyed.order_by(None).order_by(*[
+        column.desc() if descending != backwards else column.asc() for column, descending in keys
+    ])
+    rows = keyed.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    has_next = backwards or more
+    has_prev = more if backwards else values is not None
+    return KeysetPage(
+        items=[row[0] if width == 1 else tuple(row[:width]) for row in rows],
+        next_cursor=_encode_page_cursor('next', rows[-1][width:]) if rows and has_next else None,
+        prev_cursor=_encode_page_cursor('prev', rows[0][width:]) if rows and has_prev else None,
+        total=estimated_count(query) if with_total else None,
+    )
+
+# Full-text product search (SQLite FTS5). Falls back to LIKE when FTS5 is unavailable.
+PRODUCT_SEARCH_TABLE = 'product_search'
+_search_index = {'available': False}
+
+def _search_terms(text):
+    return [t for t in re.findall(r'\w+', (text or '').lower()) if t]
+
+def _closest_search_terms(term):
+    """Returns indexed terms that start with, or are a close misspelling of, `term`."""
+    vocab_table = f'{PRODUCT_SEARCH_TABLE}_vocab'
+    has_prefix = db.session.execute(
+        db.text(f'SELECT 1 FROM {vocab_table} WHERE term >= :lo AND term < :hi LIMIT 1'),
+        {'lo': term, 'hi': term + '\uffff'}
+    ).first()
+    if has_prefix:
+        return [term]
+    # Only compare against terms sharing the first letter to keep the candidate set small
+    candidates = [r[0] for r in db.session.execute(
+        db.text(f'SELECT term FROM {vocab_table} WHERE term >= :lo AND term < :hi'),
+        {'lo': term[0], 'hi': term[0] + '\uffff'}
+    )]
+    return difflib.get_close_matches(term, candidates, n=3, cutoff=0.7)
+
+def build_search_match(text):
+    """Builds an FTS5 MATCH expression with prefix matching and typo correction per term."""
+    clauses = []
+    for term in _search_terms(text):
+        options = _closest_search_terms(term) or [term]
+        clauses.append('(' + ' OR '.join(f'"{option}"*' for option in options) + ')')
+    return ' AND '.join(clauses)
+
+def apply_product_search(query, search_text):
+    """Filters a Product query by a search string. Returns (query, rank) where rank
+    is a column to order by for relevance, or None when falling back to LIKE."""
+    if not _search_index['available']:
+        return query.filter(Product.name.ilike(f'%{search_text}%')), None
+    match = build_search_match(search_text)
+    if not match:
+        # Nothing searchable (e.g. only punctuation): no product matches
+        return query.filter(db.false()), None
+    # bm25 weights: name matches count more than category matches
+    hits = db.text(
+        f'SELECT rowid AS product_id, bm25({PRODUCT_SEARCH_TABLE}, 10.0, 2.0) AS rank '
+        f'FROM {PRODUCT_SEARCH_TABLE} WHERE {PRODUCT_SEARCH_TABLE} MATCH :match'
+    ).bindparams(match=match).columns(product_id=db.Integer, rank=db.Float).subquery()
+    return query.join(hits, Product.id == hits.c.product_id), hits.c.rank
+
+# The index is kept current by triggers on the product table, so bulk Query.update()/
+# delete() and raw SQL stay in step as well as ORM flushes.
+PRODUCT_SEARCH_TRIGGERS = {
+    'product_search_ai': f"""AFTER INSERT ON product BEGIN
+        INSERT INTO {PRODUCT_SEARCH_TABLE} (rowid, name, category) VALUES (new.id, new.name, new.category);
+    END""",
+    'product_search_ad': f"""AFTER DELETE ON product BEGIN
+        DELETE FROM {PRODUCT_SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    'product_search_au': f"""AFTER UPDATE OF id, name, category ON product BEGIN
+        DELETE FROM {PRODUCT_SEARCH_TABLE} WHERE rowid = old.id;
+        INSERT INTO {PRODUCT_SEARCH_TABLE} (rowid, name, category) VALUES (new.id, new.name, new.category);
+    END""",
+}
+
+def rebuild_product_search_index():
+    """Re-creates the search index from the product table. Caller commits."""
+    db.session.execute(db.text(f'DELETE FROM {PRODUCT_SEARCH_TABLE}'))
+    db.session.execute(db.text(
+        f'INSERT INTO {PRODUCT_SEARCH_TABLE} (rowid, name, category) SELECT id, name, category FROM product'
+    ))
+    return Product.query.count()
+
+# Read replica routing for analytics views
+_read_replica = {'healthy': False, 'checked_at': None, 'lock': threading.Lock()}
+
+def _newest_order_time(connection):
+    return connection.execute(db.select(db.func.max(Order.created_at))).scalar()
+
+def _check_read_replica():
+    """The replica is usable when it answers and its newest order is within
+    READ_REPLICA_MAX_LAG_SECONDS of the primary's."""
     try:
-        cols = [r[1] for r in db.session.execute(db.text('PRAGMA table_info("order")')).fetchall()]
-        if 'delivery_fee' not in cols:
-            db.session.execute(db.text('ALTER TABLE "order" ADD COLUMN delivery_fee FLOAT DEFAULT 0.0'))
-        if 'delivery_cost' not in cols:
-            db.session.execute(db.text('ALTER TABLE "order" ADD COLUMN delivery_cost FLOAT DEFAULT 0.0'))
-        if 'delivery_person_id' not in cols:
-            db.session.execute(db.text('ALTER TABLE "order" ADD COLUMN delivery_person_id INTEGER REFERENCES delivery_person(id)'))
-            db.session.commit()
-    except Exception:
-        pass
-    # Check for unit in product table
+        with db.engines['read'].connect() as connection:
+            replica_newest = _newest_order_time(connection)
+        with db.engine.connect() as connection:
+            primary_newest = _newest_order_time(connection)
+    except Exception as e:
+        app.logger.warning(f'Read replica unavailable, using the primary: {e}')
+        return False
+    if primary_newest is None:
+        return True
+    if replica_newest is None:
+        return False
+    lag = (primary_newest - replica_newest).total_seconds()
+    if lag > READ_REPLICA_MAX_LAG_SECONDS:
+        app.logger.warning(f'Read replica is {lag:.0f}s behind, using the primary')
+        return False
+    return True
+
+def read_engine():
+    """Returns the read engine, or None when analytics should stay on the primary.
+    Health is rechecked at most every READ_REPLICA_CHECK_SECONDS per process."""
+    if not READ_DATABASE_URI:
+        return None
+    now = time.monotonic()
+    checked_at = _read_replica['checked_at']
+    if checked_at is None or now - checked_at > READ_REPLICA_CHECK_SECONDS:
+        with _read_replica['lock']:
+            if _read_replica['checked_at'] == checked_at:
+                _read_replica['healthy'] = _check_read_replica()
+                _read_replica['checked_at'] = time.monotonic()
+    return db.engines['read'] if _read_replica['healthy'] else None
+
+def read_replica(f):
+    """Runs a read-only view's queries against the read engine (see RoutingSession)."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        db.session.info['read_only'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            db.session.info.pop('read_only', None)
+    return decorated_function
+
+# Admin header stats cache, shared by every admin page
+_admin_header_stats_cache = {'value': None, 'expires_at': 0.0}
+_ADMIN_STATS_MODELS = (Order, Product, User)
+
+def invalidate_admin_header_stats():
+    """Drops the cached admin header counters so the next admin page recomputes them."""
+    _admin_header_stats_cache['value'] = None
+    _admin_header_stats_cache['expires_at'] = 0.0
+
+def get_admin_header_stats():
+    """Returns the sidebar/header counters used across the admin panel, cached for a short TTL."""
+    now = time.monotonic()
+    if _admin_header_stats_cache['value'] is not None and now < _admin_header_stats_cache['expires_at']:
+        return dict(_admin_header_stats_cache['value'])
+
+    order_stats = db.session.query(
+        db.func.count(Order.id),
+        db.func.coalesce(db.func.sum(Order.total_amount), 0),
+        db.func.coalesce(db.func.sum(db.case((Order.status == 'Pending', 1), else_=0)), 0)
+    ).one()
+    product_stats = db.session.query(
+        db.func.count(Product.id),
+        db.func.coalesce(db.func.sum(db.case((Product.quantity <= LOW_STOCK_THRESHOLD, 1), else_=0)), 0)
+    ).one()
+
+    stats = {
+        'total_orders_count': order_stats[0],
+        'total_sales': order_stats[1],
+        'pending_orders_count': order_stats[2],
+        'total_products_count': product_stats[0],
+        'low_stock_count': product_stats[1],
+        'total_users_count': User.query.count()
+    }
+    _admin_header_stats_cache['value'] = stats
+    _admin_header_stats_cache['expires_at'] = now + ADMIN_STATS_TTL_SECONDS
+    return dict(stats)
+
+@event.listens_for(db.session, 'after_flush')
+def _track_admin_stats_writes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _ADMIN_STATS_MODELS):
+            session.info['admin_stats_dirty'] = True
+            return
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _track_admin_stats_bulk_writes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, _ADMIN_STATS_MODELS):
+            orm_execute_state.session.info['admin_stats_dirty'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_admin_stats_on_commit(session):
+    if session.info.pop('admin_stats_dirty', False):
+        invalidate_admin_header_stats()
+
+@event.listens_for(db.session, 'after_rollback')
+def _reset_admin_stats_flag(session):
+    session.info.pop('admin_stats_dirty', None)
+
+# Schema migrations. Each function brings the database up to its position in
+# MIGRATIONS (version 1, 2, ...); `flask migrate` applies the pending ones once,
+# under a lock, and records the version in the schema_version row. Migrations
+# must be safe to run against databases created by older versions of the app.
+# Migration 1's create_all() never re-runs on a migrated database, so a model,
+# column or index added later needs its own migration (table.create(checkfirst=True),
+# _add_missing_columns, model_indexes) appended at the end. Migrations also run
+# before the ones after them, so they must not load whole ORM rows: select named
+# columns or use Core statements, since the models map columns added later.
+MIGRATIONS = []
+MIGRATION_LOCK_SECONDS = 600
+AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', '0') == '1'
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+def _table_columns(table):
+    return {column['name'] for column in db.inspect(db.session.connection()).get_columns(table)}
+
+def _add_missing_columns(table, columns):
+    """Adds each (name, DDL type) column the table lacks. Returns the names added."""
+    existing = _table_columns(table)
+    added = []
+    for name, ddl in columns:
+        if name not in existing:
+            db.session.execute(db.text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+            added.append(name)
+    return added
+
+@migration
+def create_tables_and_legacy_columns():
+    """Creates missing tables and adds columns introduced before versioned migrations."""
+    db.create_all()
+    _add_missing_columns('user', [('phone', 'VARCHAR(20)'), ('account_number', 'VARCHAR(50)'),
+                                  ('upi_phone_number', 'VARCHAR(20)'), ('is_approved', 'BOOLEAN DEFAULT 1')])
+    _add_missing_columns('order', [('shipping_address', 'TEXT'), ('delivery_fee', 'FLOAT DEFAULT 0.0'),
+                                   ('delivery_cost', 'FLOAT DEFAULT 0.0'),
+                                   ('delivery_person_id', 'INTEGER REFERENCES delivery_person(id)')])
+    _add_missing_columns('product', [('unit', "VARCHAR(20) DEFAULT 'kg'")])
+    added = _add_missing_columns('order_item', [('seller_id', 'INTEGER'), ('is_paid_to_seller', 'BOOLEAN DEFAULT 0'),
+                                                ('commission_amount', 'FLOAT DEFAULT 0.0')])
+    if 'seller_id' in added:
+        # Backfill seller_id from product table for existing items
+        db.session.execute(db.text('UPDATE order_item SET seller_id = (SELECT seller_id FROM product WHERE product.id = order_item.product_id) WHERE seller_id IS NULL'))
+    if 'commission_amount' in added:
+        # Backfill commission for existing items based on default rate
+        db.session.execute(db.text(f'UPDATE order_item SET commission_amount = price * quantity * {DEFAULT_COMMISSION_RATE} WHERE commission_amount = 0.0'))
+    _add_missing_columns('payout', [('commission_total', 'FLOAT DEFAULT 0.0')])
+
+@migration
+def product_rating_aggregates():
+    added = _add_missing_columns('product', [('avg_rating', 'FLOAT NOT NULL DEFAULT 0.0'),
+                                             ('review_count', 'INTEGER NOT NULL DEFAULT 0')])
+    if added:
+        # Backfill aggregates for existing reviews
+        recompute_product_ratings()
+
+@migration
+def default_settings_and_admin():
+    for key, value in (('shipping_fee', DEFAULT_SHIPPING_FEE), ('free_shipping_threshold', DEFAULT_FREE_SHIPPING_THRESHOLD),
+                       ('delivery_partner_cost', DEFAULT_DELIVERY_PARTNER_COST), ('commission_rate', DEFAULT_COMMISSION_RATE)):
+        if not db.session.get(SiteSetting, key):
+            db.session.add(SiteSetting(key=key, value=str(value)))
+    if db.session.scalar(db.select(DeliverySlab.id).limit(1)) is None:
+        db.session.add_all([DeliverySlab(max_km=max_km, fee=fee, cost=cost)
+                            for max_km, fee, cost in DEFAULT_DELIVERY_SLABS])
+    # Create admin user if not exists. Only v1 columns are named: the ORM model also
+    # maps columns that later migrations add.
+    if db.session.scalar(db.select(User.id).where(User.role == 'admin').limit(1)) is None:
+        db.session.execute(db.text(
+            'INSERT INTO "user" (name, email, password, role, created_at, is_approved) '
+            'VALUES (:name, :email, :password, :role, :created_at, 1)'
+        ), {'name': 'Admin', 'email': 'admin@agrimarket.com',
+            'password': generate_password_hash(os.environ.get('ADMIN_PASSWORD', 'admin123')),
+            'role': 'admin', 'created_at': datetime.utcnow()})
+
+@migration
+def model_indexes():
+    """Creates model indexes that create_all() skips on pre-existing tables."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            db.session.execute(CreateIndex(index, if_not_exists=True))
+
+@migration
+def product_search_index():
+    """Full-text search index over product name and category, where FTS5 is available."""
     try:
-        cols = [r[1] for r in db.session.execute(db.text('PRAGMA table_info(product)')).fetchall()]
-        if 'unit' not in cols:
-            db.session.execute(db.text("ALTER TABLE product ADD COLUMN unit VARCHAR(20) DEFAULT 'kg'"))
-            db.session.commit()
+        with db.engine.begin() as connection:
+            connection.execute(db.text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_SEARCH_TABLE} USING fts5("
+                f"name, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            ))
+            connection.execute(db.text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_SEARCH_TABLE}_vocab USING fts5vocab({PRODUCT_SEARCH_TABLE}, 'row')"
+            ))
     except Exception:
-        pass
-    # Check for seller_id and is_paid_to_seller in order_item
+        return
+    _search_index['available'] = True
+    db.session.execute(db.update(SchemaVersion).values(search_index=True))
+    if not db.session.execute(db.text(f'SELECT 1 FROM {PRODUCT_SEARCH_TABLE} LIMIT 1')).first():
+        rebuild_product_search_index()
+
+@migration
+def daily_sales_rollup_backfill():
+    # The rebuild reads order_item.category, so it is added here rather than left to order_item_category()
+    _add_order_item_category()
+    if db.session.scalar(db.select(DailySalesRollup.day).limit(1)) is None \
+            and db.session.scalar(db.select(Order.id).limit(1)) is not None:
+        rebuild_daily_sales_rollup()
+
+@migration
+def keyset_pagination_indexes():
+    """Indexes on the list sort columns (user.created_at, product.price)."""
+    model_indexes()
+
+@migration
+def keyset_sort_keys():
+    """Fills NULL created_at (rows inserted outside the ORM) with the table's oldest timestamp,
+    where they already sorted, so keyset cursors never hold a NULL."""
+    for model in (User, Product, Order):
+        table = model.__table__
+        oldest = db.session.scalar(db.select(db.func.min(table.c.created_at)))
+        db.session.execute(db.update(table).where(table.c.created_at.is_(None))
+                           .values(created_at=oldest or datetime.utcnow()))
+
+@migration
+def user_cart_version():
+    _add_missing_columns('user', [('cart_version', 'INTEGER NOT NULL DEFAULT 0')])
+
+def _add_order_item_category():
+    """Snapshots each item's category so the sales rollup no longer depends on the live product."""
+    if _add_missing_columns('order_item', [('category', 'VARCHAR(50)')]):
+        db.session.execute(db.text(
+            'UPDATE order_item SET category = (SELECT category FROM product WHERE product.id = order_item.product_id) '
+            'WHERE category IS NULL'
+        ))
+
+@migration
+def order_item_category():
+    _add_order_item_category()
+
+@migration
+def product_search_triggers():
+    """Replaces ORM-event indexing with triggers, then rebuilds rows that bulk paths left stale."""
+    if not _search_index['available']:
+        return
+    for name, body in PRODUCT_SEARCH_TRIGGERS.items():
+        db.session.execute(db.text(f'CREATE TRIGGER IF NOT EXISTS {name} {body}'))
+    rebuild_product_search_index()
+
+@migration
+def promotion_campaign_heartbeat():
+    PromotionCampaign.__table__.create(db.session.connection(), checkfirst=True)
+    _add_missing_columns('promotion_campaign', [('heartbeat_at', 'DATETIME')])
+
+LATEST_SCHEMA_VERSION = len(MIGRATIONS)
+
+def read_schema_state():
+    """One query: returns the applied schema version and sets the feature flags recorded with it."""
     try:
-        cols = [r[1] for r in db.session.execute(db.text('PRAGMA table_info(order_item)')).fetchall()]
-        if 'seller_id' not in cols:
-            db.session.execute(db.text('ALTER TABLE order_item ADD COLUMN seller_id INTEGER'))
-            # Backfill seller_id from product table for existing items
-            db.session.execute(db.text('UPDATE order_item SET seller_id = (SELECT seller_id FROM product WHERE product.id = order_item.product_id) WHERE seller_id IS NULL'))
-            db.session.commit()
-        if 'is_paid_to_seller' not in cols:
-            db.session.execute(db.text('ALTER TABLE order_item ADD COLUMN is_paid_to_seller BOOLEAN DEFAULT 0'))
-            db.session.commit()
-        if 'commission_amount' not in cols:
-            db.session.execute(db.text('ALTER TABLE order_item ADD COLUMN commission_amount FLOAT DEFAULT 0.0'))
-            # Backfill commission for existing items based on default rate
-            db.session.execute(db.text(f'UPDATE order_item SET commission_amount = price * quantity * {DEFAULT_COMMISSION_RATE} WHERE commission_amount = 0.0'))
-            db.session.commit()
+        row = db.session.execute(
+            db.select(SchemaVersion.version, SchemaVersion.search_index).where(SchemaVersion.id == 1)
+        ).first()
     except Exception:
-        pass
-    # Check for commission_total in payout table
-    try:
-        cols = [r[1] for r in db.session.execute(db.text('PRAGMA table_info(payout)')).fetchall()]
-        if 'commission_total' not in cols:
-            db.session.execute(db.text('ALTER TABLE payout ADD COLUMN commission_total FLOAT DEFAULT 0.0'))
+        # No schema_version table yet: nothing has been migrated
+        db.session.rollback()
+        row = None
+    _search_index['available'] = bool(row and row.search_index)
+    return row.version if row else 0
+
+def _acquire_migration_lock():
+    SchemaVersion.__table__.create(db.engine, checkfirst=True)
+    if not db.session.get(SchemaVersion, 1):
+        try:
+            db.session.add(SchemaVersion(id=1, version=0))
             db.session.commit()
-    except Exception:
-        pass
-    # Initialize default settings
+        except Exception:
+            db.session.rollback()  # another process inserted it first
+    now = datetime.utcnow()
+    acquired = SchemaVersion.query.filter(
+        SchemaVersion.id == 1,
+        db.or_(SchemaVersion.locked_until.is_(None), SchemaVersion.locked_until < now)
+    ).update({SchemaVersion.locked_until: now + timedelta(seconds=MIGRATION_LOCK_SECONDS)}, synchronize_session=False)
+    db.session.commit()
+    return bool(acquired)
+
+def run_migrations(wait_seconds=60):
+    """Applies pending migrations in order and returns the names applied.
+    Waits up to wait_seconds for a migration already running in another process."""
+    deadline = time.monotonic() + wait_seconds
+    while not _acquire_migration_lock():
+        if time.monotonic() > deadline:
+            raise RuntimeError('Timed out waiting for the migration lock')
+        time.sleep(1)
+
+    applied = []
     try:
-        if not SiteSetting.query.first():
-            db.session.add(SiteSetting(key='shipping_fee', value=str(DEFAULT_SHIPPING_FEE)))
-            db.session.add(SiteSetting(key='free_shipping_threshold', value=str(DEFAULT_FREE_SHIPPING_THRESHOLD)))
-            db.session.add(SiteSetting(key='delivery_partner_cost', value=str(DEFAULT_DELIVERY_PARTNER_COST)))
-            db.session.add(SiteSetting(key='commission_rate', value=str(DEFAULT_COMMISSION_RATE)))
+        version = db.session.scalar(db.select(SchemaVersion.version).where(SchemaVersion.id == 1))
+        for number, func in enumerate(MIGRATIONS[version:], start=version + 1):
+            func()
+            db.session.execute(db.update(SchemaVersion).where(SchemaVersion.id == 1)
+                               .values(version=number, applied_at=datetime.utcnow()))
             db.session.commit()
-        # Ensure commission_rate exists if settings are already there
-        elif not db.session.get(SiteSetting, 'commission_rate'):
-             db.session.add(SiteSetting(key='commission_rate', value=str(DEFAULT_COMMISSION_RATE)))
-             db.session.commit()
+            applied.append(func.__name__)
     except Exception:
-        pass
-    # Create admin user if not exists
-    if not User.query.filter_by(role='admin').first():
-        admin_user = User(
-            name='Admin',
-            email='admin@agrimarket.com',
-            password=generate_password_hash(os.environ.get('ADMIN_PASSWORD', 'admin123')),
-            role='admin'
-        )
-        db.session.add(admin_user)
+        db.session.rollback()
+        raise
+    finally:
+        db.session.execute(db.update(SchemaVersion).where(SchemaVersion.id == 1).values(locked_until=None))
         db.session.commit()
+        read_schema_state()
+    return applied
+
+with app.app_context():
+    _schema_version = read_schema_state()
+    if _schema_version < LATEST_SCHEMA_VERSION:
+        if AUTO_MIGRATE:
+            run_migrations()
+        else:
+            app.logger.warning(f"Database schema is at version {_schema_version}, this code expects "
+                               f"{LATEST_SCHEMA_VERSION}. Run `flask migrate`.")
+
+@app.errorhandler(OperationalError)
+def database_busy(error):
+    """A write that still finds the database locked after busy_timeout gets a retryable 503."""
+    if 'database is locked' not in str(error.orig):
+        raise error
+    db.session.rollback()
+    app.logger.warning(f'Database still locked after {SQLITE_BUSY_TIMEOUT_MS} ms; asking the client to retry')
+    message = 'The server is busy, please try again.'
+    if request.is_json or request.path.startswith('/api/'):
+        response = jsonify({'error': message})
+    else:
+        response = make_response(message)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(DB_LOCKED_RETRY_AFTER_SECONDS)
+    return response
 
 # Helper Decorator for role-based access
 def roles_required(*roles):
@@ -291,108 +1323,807 @@ def roles_required(*roles):
 
 def send_sms(to, message):
     try:
-        if twilio_client and TWILIO_FROM_NUMBER and to:
-            twilio_client.messages.create(to=to, from_=TWILIO_FROM_NUMBER, body=message)
+        client = twilio_client.get()
+        if client and TWILIO_FROM_NUMBER and to:
+            client.messages.create(to=to, from_=TWILIO_FROM_NUMBER, body=message)
             return True
     except Exception:
         return False
     return False
 
 def send_reset_email(to_email, reset_link):
-    """Sends password reset email or logs to console if SMTP not configured."""
-    sender_email = os.environ.get('MAIL_USERNAME')
-    sender_password = os.environ.get('MAIL_PASSWORD')
-    smtp_server = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-    smtp_port = int(os.environ.get('MAIL_PORT', 587))
+    """Queues the password reset email."""
+    body = f"Click the following link to reset your password: {reset_link}\n\nIf you did not request this, please ignore this email.\nLink expires in 1 hour."
+    queue_email(to_email, "Password Reset Request - Cropify", body)
+    return True
+
+def mail_settings():
+    """Reads SMTP configuration from the environment. MAIL_USE_TLS=0 and MAIL_USE_AUTH=0
+    allow plain local servers such as a debugging SMTP sink."""
+    return {
+        'server': os.environ.get('MAIL_SERVER', 'smtp.gmail.com'),
+        'port': int(os.environ.get('MAIL_PORT', 587)),
+        'username': os.environ.get('MAIL_USERNAME'),
+        'password': os.environ.get('MAIL_PASSWORD'),
+        'use_tls': os.environ.get('MAIL_USE_TLS', '1') != '0',
+        'use_auth': os.environ.get('MAIL_USE_AUTH', '1') != '0',
+    }
+
+class SMTPConnection:
+    """A pooled SMTP session that reconnects once if the server has dropped it."""
+    def __init__(self, pool):
+        self.pool = pool
+        self.server = None
+        self.last_used = 0
+        self.sent = 0
+
+    def connect(self):
+        import smtplib
+        self.close()
+        settings = self.pool.settings
+        server = smtplib.SMTP(settings['server'], settings['port'], timeout=30)
+        if settings['use_tls']:
+            server.starttls()
+        if settings['use_auth']:
+            server.login(settings['username'], settings['password'])
+        self.server, self.sent = server, 0
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self.server = None
+
+    def stale(self):
+        return (self.server is None
+                or time.monotonic() - self.last_used > SMTP_MAX_IDLE_SECONDS
+                or self.sent >= SMTP_MAX_MESSAGES_PER_CONNECTION)
+
+    def sendmail(self, sender, recipient, message):
+        import smtplib
+        if self.stale():
+            self.connect()
+        try:
+            self.server.sendmail(sender, recipient, message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+            self.connect()
+            self.server.sendmail(sender, recipient, message)
+        self.sent += 1
+        self.last_used = time.monotonic()
+
+class SMTPPool:
+    """Keeps up to `size` authenticated SMTP sessions open for reuse across sends."""
+    def __init__(self, settings, size=SMTP_POOL_SIZE):
+        self.settings = settings
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return SMTPConnection(self)
+
+    def release(self, connection):
+        with self._lock:
+            if connection.server is not None and len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def send_many(self, messages):
+        """Sends (recipient, subject, body) tuples over one session.
+        Returns a (delivered, error) pair per message."""
+        import smtplib
+        sender = self.settings['username']
+        results = []
+        connection = self.acquire()
+        try:
+            for recipient, subject, body in messages:
+                try:
+                    connection.sendmail(sender, recipient, build_email(sender, recipient, subject, body))
+                    results.append((True, None))
+                except smtplib.SMTPRecipientsRefused as e:
+                    # Only this recipient was rejected; the session is still usable
+                    results.append((False, str(e)))
+                except Exception as e:
+                    connection.close()
+                    results.append((False, str(e)))
+        finally:
+            self.release(connection)
+        return results
+
+_smtp_pool = {'pool': None, 'lock': threading.Lock()}
+
+def get_smtp_pool():
+    """Returns the process-wide SMTP pool, rebuilding it if the mail settings changed."""
+    settings = mail_settings()
+    with _smtp_pool['lock']:
+        pool = _smtp_pool['pool']
+        if pool is None or pool.settings != settings:
+            if pool is not None:
+                pool.close_all()
+            pool = _smtp_pool['pool'] = SMTPPool(settings)
+    return pool
+
+def mail_dev_mode(settings):
+    return not settings['username'] or (settings['use_auth'] and not settings['password'])
+
+def build_email(sender, recipient, subject, body):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg.as_string()
+
+def send_notification_emails(messages):
+    """Sends (recipient, subject, body) tuples through the pooled SMTP connection.
+    Returns a (delivered, error) pair per message."""
+    settings = mail_settings()
 
     # If credentials are missing, log to console for development
-    if not sender_email or not sender_password:
-        print(f"\n{'='*50}")
-        print(f"[DEV MODE] Password Reset Link for {to_email}:")
-        print(f"{reset_link}")
-        print(f"{'='*50}\n")
-        return True
+    if mail_dev_mode(settings):
+        for to_email, subject, body in messages:
+            print(f"\n[DEV MODE] Email to {to_email}\nSubject: {subject}\nBody: {body}\n")
+        return [(True, None)] * len(messages)
 
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = to_email
-        msg['Subject'] = "Password Reset Request - Cropify"
-
-        body = f"Click the following link to reset your password: {reset_link}\n\nIf you did not request this, please ignore this email.\nLink expires in 1 hour."
-        msg.attach(MIMEText(body, 'plain'))
-
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        text = msg.as_string()
-        server.sendmail(sender_email, to_email, text)
-        server.quit()
-        return True
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        return False
+    results = get_smtp_pool().send_many(messages)
+    for (to_email, _, _), (delivered, error) in zip(messages, results):
+        if not delivered:
+            print(f"Failed to send email to {to_email}: {error}")
+    return results
 
 def send_notification_email(to_email, subject, body):
     """Sends a general notification email."""
-    sender_email = os.environ.get('MAIL_USERNAME')
-    sender_password = os.environ.get('MAIL_PASSWORD')
-    smtp_server = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-    smtp_port = int(os.environ.get('MAIL_PORT', 587))
-
-    # If credentials are missing, log to console for development
-    if not sender_email or not sender_password:
-        print(f"\n[DEV MODE] Email to {to_email}\nSubject: {subject}\nBody: {body}\n")
+    delivered, _ = send_notification_emails([(to_email, subject, body)])[0]
+    return delivered
+
+class LiveTransport:
+    """Delivers outbox messages through Twilio and SMTP (or the console in dev mode)."""
+    def send(self, message):
+        return self.send_batch([message])[0]
+
+    def send_batch(self, messages):
+        """Returns a (delivered, error) pair per message; emails share one SMTP session."""
+        results = {}
+        emails = [m for m in messages if m.channel == 'email']
+        if emails:
+            sent = send_notification_emails([(m.recipient, m.subject, m.body) for m in emails])
+            results.update(zip((m.id for m in emails), sent))
+        for message in messages:
+            if message.channel != 'sms':
+                continue
+            if not twilio_client.get() or not TWILIO_FROM_NUMBER:
+                print(f"\n[DEV MODE] SMS to {message.recipient}: {message.body}\n")
+                results[message.id] = (True, None)
+            else:
+                delivered = send_sms(message.recipient, message.body)
+                results[message.id] = (delivered, None if delivered else 'Transport reported failure')
+        return [results.get(m.id, (False, f'Unknown channel {m.channel}')) for m in messages]
+
+class FakeTransport:
+    """Records outbox messages in memory instead of sending them, for offline testing."""
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append({'channel': message.channel, 'recipient': message.recipient,
+                          'subject': message.subject, 'body': message.body})
         return True
 
+notification_transport = FakeTransport() if NOTIFICATION_TRANSPORT == 'fake' else LiveTransport()
+_dispatcher = {'thread': None, 'wake': threading.Event(), 'lock': threading.Lock()}
+
+def queue_notification(channel, recipient, body, subject=None, commit=True):
+    """Adds a message to the outbox. With commit=False it is sent only if the caller's transaction commits."""
+    if not recipient:
+        return None
+    message = OutboxMessage(channel=channel, recipient=recipient, subject=subject, body=body,
+                            next_attempt_at=datetime.utcnow())
+    db.session.add(message)
+    if commit:
+        db.session.commit()
+    wake_notification_dispatcher()
+    return message
+
+def queue_sms(to, message, commit=True):
+    return queue_notification('sms', to, message, commit=commit)
+
+def queue_email(to_email, subject, body, commit=True):
+    return queue_notification('email', to_email, body, subject=subject, commit=commit)
+
+def _claim_outbox_batch(limit):
+    """Leases up to `limit` due messages to this dispatcher and returns them."""
+    now = datetime.utcnow()
+    token = str(uuid.uuid4())
+    due_ids = db.select(OutboxMessage.id).where(
+        OutboxMessage.status == 'pending',
+        OutboxMessage.next_attempt_at <= now
+    ).order_by(OutboxMessage.id).limit(limit)
+    # Leasing pushes next_attempt_at forward, so a crashed dispatcher's batch is retried later
+    OutboxMessage.query.filter(OutboxMessage.id.in_(due_ids), OutboxMessage.status == 'pending')\
+        .update({OutboxMessage.claim_token: token,
+                 OutboxMessage.next_attempt_at: now + timedelta(seconds=NOTIFICATION_CLAIM_SECONDS)},
+                synchronize_session=False)
+    db.session.commit()
+    return OutboxMessage.query.filter_by(claim_token=token).order_by(OutboxMessage.id).all()
+
+def _send_one(transport, message):
     try:
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, to_email, msg.as_string())
-        server.quit()
-        return True
+        delivered = transport.send(message)
+        return delivered, None if delivered else 'Transport reported failure'
+    except Exception as e:
+        return False, str(e)
+
+def dispatch_outbox(limit=NOTIFICATION_BATCH_SIZE, transport=None):
+    """Sends one batch of due messages, rescheduling failures with exponential backoff.
+    Returns the number of messages attempted."""
+    transport = transport or notification_transport
+    messages = _claim_outbox_batch(limit)
+    if hasattr(transport, 'send_batch'):
+        try:
+            results = transport.send_batch(messages)
+        except Exception as e:
+            results = [(False, str(e))] * len(messages)
+    else:
+        results = [_send_one(transport, message) for message in messages]
+    for message, (delivered, error) in zip(messages, results):
+        message.attempts += 1
+        message.claim_token = None
+        if delivered:
+            message.status = 'sent'
+            message.sent_at = datetime.utcnow()
+            message.last_error = None
+        else:
+            message.last_error = error
+            if message.attempts >= NOTIFICATION_MAX_ATTEMPTS:
+                message.status = 'failed'
+            else:
+                delay = NOTIFICATION_RETRY_BASE_SECONDS * (2 ** (message.attempts - 1))
+                message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    db.session.commit()
+    return len(messages)
+
+def _notification_dispatcher_loop(poll_seconds):
+    resumed_at = None
+    while True:
+        _dispatcher['wake'].wait(poll_seconds)
+        _dispatcher['wake'].clear()
+        try:
+            with app.app_context():
+                while dispatch_outbox():
+                    pass
+                if resumed_at is None or time.monotonic() - resumed_at > PROMOTION_RESUME_CHECK_SECONDS:
+                    resumed_at = time.monotonic()
+                    resume_promotion_campaigns()
+        except Exception as e:
+            app.logger.error(f"Notification dispatcher error: {e}")
+
+def wake_notification_dispatcher():
+    """Nudges the in-process dispatcher, starting it on first use in this worker."""
+    if NOTIFICATION_DISPATCHER != 'thread' or app.config.get('TESTING'):
+        return
+    with _dispatcher['lock']:
+        if _dispatcher['thread'] is None or not _dispatcher['thread'].is_alive():
+            _dispatcher['thread'] = threading.Thread(target=_notification_dispatcher_loop, args=(5,),
+                                                     name='notification-dispatcher', daemon=True)
+            _dispatcher['thread'].start()
+    _dispatcher['wake'].set()
+
+class RateLimiter:
+    """Token bucket shared by sender threads: acquire(n) blocks until n sends are allowed."""
+    def __init__(self, per_second):
+        self.per_second = per_second
+        self.tokens = per_second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.per_second, self.tokens + (now - self.updated) * self.per_second)
+                self.updated = now
+                # Batches larger than the bucket go through once it is full
+                if self.tokens >= min(count, self.per_second):
+                    self.tokens -= count
+                    return
+                wait = (min(count, self.per_second) - self.tokens) / self.per_second
+            time.sleep(wait)
+
+PromotionMessage = namedtuple('PromotionMessage', 'id channel recipient subject body')
+
+def render_promotion(template, name):
+    """Personalises a promotion; only the {name} placeholder is substituted."""
+    return template.replace('{name}', name or 'there')
+
+def _promotion_messages(campaign, rows, channels):
+    messages = []
+    for user_id, name, email, phone in rows:
+        body = render_promotion(campaign.message, name)
+        if 'email' in channels and email:
+            messages.append(PromotionMessage(len(messages), 'email', email, campaign.subject, body))
+        if 'sms' in channels and phone:
+            messages.append(PromotionMessage(len(messages), 'sms', phone, None, body))
+    return messages
+
+def _send_promotion_batch(transport, limiter, batch):
+    limiter.acquire(len(batch))
+    if hasattr(transport, 'send_batch'):
+        try:
+            return transport.send_batch(batch)
+        except Exception as e:
+            return [(False, str(e))] * len(batch)
+    return [_send_one(transport, message) for message in batch]
+
+def _stale_campaign():
+    cutoff = datetime.utcnow() - timedelta(seconds=PROMOTION_STALE_SECONDS)
+    return db.and_(PromotionCampaign.status == 'running',
+                   db.func.coalesce(PromotionCampaign.heartbeat_at, PromotionCampaign.started_at) < cutoff)
+
+def requeue_stale_campaigns():
+    """Re-queues running campaigns whose runner stopped checking in. Caller commits."""
+    return db.session.execute(
+        db.update(PromotionCampaign).where(_stale_campaign()).values(status='queued'),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+
+def _claim_promotion_campaign(campaign_id):
+    """Marks the campaign running unless it is completed or another runner is still alive."""
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        db.update(PromotionCampaign)
+        .where(PromotionCampaign.id == campaign_id,
+               db.or_(PromotionCampaign.status.in_(('queued', 'failed')), _stale_campaign()))
+        .values(status='running', heartbeat_at=now,
+                started_at=db.func.coalesce(PromotionCampaign.started_at, now)),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+    return bool(claimed)
+
+def run_promotion_campaign(campaign_id, transport=None, claimed=False):
+    """Sends a campaign to its audience, committing progress and the keyset cursor after each chunk.
+    Claims the campaign first unless the caller already has (claimed=True)."""
+    transport = transport or notification_transport
+    claimed = claimed or _claim_promotion_campaign(campaign_id)
+    campaign = db.session.get(PromotionCampaign, campaign_id, populate_existing=True)
+    if campaign is None or not claimed:
+        return campaign
+
+    roles = PROMOTION_AUDIENCES.get(campaign.audience, PROMOTION_AUDIENCES['all'])
+    channels = campaign.channels.split(',')
+    if campaign.total_recipients is None:
+        campaign.total_recipients = db.session.scalar(db.select(db.func.count(User.id)).where(User.role.in_(roles)))
+        db.session.commit()
+
+    limiters = {'sms': RateLimiter(PROMOTION_SMS_PER_SECOND), 'email': RateLimiter(PROMOTION_EMAILS_PER_SECOND)}
+    try:
+        with ThreadPoolExecutor(max_workers=PROMOTION_WORKERS, thread_name_prefix='promotion') as executor:
+            while True:
+                # Only the columns needed to render are loaded, one chunk at a time
+                rows = db.session.execute(
+                    db.select(User.id, User.name, User.email, User.phone)
+                    .where(User.id > campaign.last_user_id, User.role.in_(roles))
+                    .order_by(User.id).limit(PROMOTION_CHUNK_SIZE)
+                ).all()
+                if not rows:
+                    break
+
+                messages = _promotion_messages(campaign, rows, channels)
+                futures = []
+                for channel in channels:
+                    channel_messages = [m for m in messages if m.channel == channel]
+                    for i in range(0, len(channel_messages), PROMOTION_SEND_BATCH):
+                        futures.append(executor.submit(_send_promotion_batch, transport, limiters[channel],
+                                                       channel_messages[i:i + PROMOTION_SEND_BATCH]))
+
+                for future in futures:
+                    for delivered, error in future.result():
+                        if delivered:
+                            campaign.sent_count += 1
+                        else:
+                            campaign.failed_count += 1
+                            campaign.last_error = error
+                campaign.last_user_id = rows[-1].id
+                campaign.heartbeat_at = datetime.utcnow()
+                db.session.commit()
+
+        campaign.status = 'completed'
     except Exception as e:
-        print(f"Failed to send email: {e}")
+        db.session.rollback()
+        campaign.status = 'failed'
+        campaign.last_error = str(e)
+        app.logger.error(f"Promotion campaign {campaign_id} failed: {e}")
+    campaign.finished_at = datetime.utcnow()
+    db.session.commit()
+    return campaign
+
+def campaign_progress(campaign):
+    """Summarises a campaign for the admin API, including its send rate."""
+    processed = campaign.sent_count + campaign.failed_count
+    elapsed = None
+    if campaign.started_at:
+        elapsed = ((campaign.finished_at or datetime.utcnow()) - campaign.started_at).total_seconds()
+    return {
+        'id': campaign.id,
+        'status': campaign.status,
+        'audience': campaign.audience,
+        'channels': campaign.channels.split(','),
+        'total_recipients': campaign.total_recipients,
+        'sent': campaign.sent_count,
+        'failed': campaign.failed_count,
+        'last_user_id': campaign.last_user_id,
+        'messages_per_second': round(processed / elapsed, 2) if elapsed else None,
+        'last_error': campaign.last_error,
+        'created_at': campaign.created_at.isoformat() if campaign.created_at else None,
+        'started_at': campaign.started_at.isoformat() if campaign.started_at else None,
+        'finished_at': campaign.finished_at.isoformat() if campaign.finished_at else None,
+    }
+
+def _promotion_campaign_thread(campaign_id):
+    with app.app_context():
+        run_promotion_campaign(campaign_id, claimed=True)
+
+def _start_promotion_thread(campaign_id):
+    """Claims the campaign, then sends it on a background thread. Returns False when
+    another process holds it, so no thread is started."""
+    if not _claim_promotion_campaign(campaign_id):
         return False
+    threading.Thread(target=_promotion_campaign_thread, args=(campaign_id,),
+                     name=f'promotion-{campaign_id}', daemon=True).start()
+    return True
+
+def start_promotion_campaign(campaign_id):
+    """Runs the campaign on a background thread, unless `flask run-notification-worker` handles it."""
+    if NOTIFICATION_DISPATCHER != 'thread' or app.config.get('TESTING'):
+        return
+    _start_promotion_thread(campaign_id)
+
+def resume_promotion_campaigns():
+    """Re-queues campaigns whose runner died and starts a runner for each queued one this
+    process manages to claim. Returns the number of runners started."""
+    requeue_stale_campaigns()
+    db.session.commit()
+    ids = db.session.scalars(db.select(PromotionCampaign.id).where(PromotionCampaign.status == 'queued')).all()
+    return sum(_start_promotion_thread(campaign_id) for campaign_id in ids)
+
+ORDER_EXPORT_COLUMNS = {
+    'order_id': Order.id,
+    'buyer_id': Order.buyer_id,
+    'total_amount': Order.total_amount,
+    'payment_mode': Order.payment_mode,
+    'status': Order.status,
+    'delivery_fee': Order.delivery_fee,
+    'delivery_cost': Order.delivery_cost,
+    'delivery_person_id': Order.delivery_person_id,
+    'shipping_address': Order.shipping_address,
+    'created_at': Order.created_at,
+}
+ORDER_ITEM_EXPORT_COLUMNS = {
+    'item_id': OrderItem.id,
+    'product_id': OrderItem.product_id,
+    'product_name': OrderItem.product_name,
+    'seller_id': OrderItem.seller_id,
+    'price': OrderItem.price,
+    'quantity': OrderItem.quantity,
+    'commission_amount': OrderItem.commission_amount,
+    'is_paid_to_seller': OrderItem.is_paid_to_seller,
+}
+
+EXPORT_TABLES = {
+    'orders': Order,
+    'order_items': OrderItem,
+    'payouts': Payout,
+    'order_status_history': OrderStatusHistory,
+}
+
+class _CSVLine:
+    """File-like sink that hands back what csv.writer writes instead of buffering it."""
+    def write(self, value):
+        return value
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def stream_csv(header, statement, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields CSV for `statement` a chunk of rows at a time from a streaming cursor,
+    so memory use does not grow with the size of the export."""
+    writer = csv.writer(_CSVLine())
+    yield writer.writerow(header).encode('utf-8')
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        yield ''.join(writer.writerow([_export_value(v) for v in row]) for row in rows).encode('utf-8')
+
+def stream_ndjson_gz(statement, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields gzip-compressed newline-delimited JSON for `statement`, one chunk of rows at a time."""
+    names = [column.name for column in statement.selected_columns]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        lines = ''.join(json.dumps(dict(zip(names, map(_export_value, row))), separators=(',', ':')) + '\n'
+                        for row in rows)
+        chunk = compressor.compress(lines.encode('utf-8'))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+def _arrow_type(pa, sql_type):
+    if isinstance(sql_type, db.Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, db.Integer):
+        return pa.int64()
+    if isinstance(sql_type, (db.Float, db.Numeric)):
+        return pa.float64()
+    if isinstance(sql_type, db.DateTime):
+        return pa.timestamp('us')
+    if isinstance(sql_type, db.Date):
+        return pa.date32()
+    return pa.string()
+
+def write_parquet(statement, chunk_size=EXPORT_CHUNK_SIZE):
+    """Writes `statement` as zstd Parquet, one row group per chunk, and returns the file
+    rewound for reading. It stays in memory up to EXPORT_SPOOL_BYTES, then spills to an
+    anonymous temporary file that is removed when closed (on every platform)."""
+    pa = pyarrow_module.get()
+    schema = pa.schema([pa.field(column.name, _arrow_type(pa, column.type)) for column in statement.selected_columns])
+    handle = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, suffix='.parquet')
+    try:
+        with pa.parquet.ParquetWriter(handle, schema, compression='zstd') as writer:
+            result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+            for rows in result.partitions():
+                arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    except Exception:
+        handle.close()
+        raise
+    handle.seek(0)
+    return handle
+
+def _run_after(chunks, callback):
+    yield from chunks
+    callback()
+
+def export_response(name, statement, fmt, on_complete=None, headers=None):
+    """Returns `statement` as a downloadable csv, ndjson.gz or parquet file named after `name`.
+    on_complete runs once the whole export has been produced."""
+    headers = dict(headers or {})
+    if fmt == 'parquet':
+        handle = write_parquet(statement)
+        if on_complete:
+            on_complete()
+        response = send_file(handle, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                             download_name=f'{name}.parquet')
+        response.headers.update(headers)
+        return response
+
+    if fmt == 'ndjson':
+        body, mimetype, filename = stream_ndjson_gz(statement), 'application/gzip', f'{name}.ndjson.gz'
+    else:
+        header = [column.name for column in statement.selected_columns]
+        body, mimetype, filename = stream_csv(header, statement), 'text/csv', f'{name}.csv'
+    if on_complete:
+        body = _run_after(body, on_complete)
+    headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+def export_format_error(fmt):
+    if fmt not in EXPORT_FORMATS:
+        return f"Unknown format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}"
+    if fmt == 'parquet' and pyarrow_module.get() is None:
+        return 'Parquet export requires pyarrow; use format=ndjson'
+    return None
+
+def advance_export_watermark(name, last_id):
+    watermark = db.session.get(ExportWatermark, name) or ExportWatermark(name=name, last_id=0)
+    watermark.last_id = max(watermark.last_id or 0, last_id)
+    watermark.updated_at = datetime.utcnow()
+    db.session.add(watermark)
+    db.session.commit()
+
+_upi_qr_cache = {'images': OrderedDict(), 'lock': threading.Lock()}
+
+def render_upi_qr(payload, fmt='png'):
+    """Returns the QR image bytes for `payload`, rendering only on an LRU cache miss."""
+    key = (payload, fmt)
+    qrcode = qrcode_module.get()
+    with _upi_qr_cache['lock']:
+        image = _upi_qr_cache['images'].get(key)
+        if image is not None:
+            _upi_qr_cache['images'].move_to_end(key)
+            return image
+
+    if fmt == 'svg':
+        image = qrcode.make(payload, image_factory=qrcode.image.svg.SvgPathImage).to_string()
+    else:
+        buf = io.BytesIO()
+        qrcode.make(payload).save(buf, 'PNG')
+        image = buf.getvalue()
+
+    with _upi_qr_cache['lock']:
+        _upi_qr_cache['images'][key] = image
+        while len(_upi_qr_cache['images']) > UPI_QR_CACHE_SIZE:
+            _upi_qr_cache['images'].popitem(last=False)
+    return image
+
+_site_settings = {'values': None, 'version': None, 'checked_at': 0.0, 'lock': threading.Lock()}
+
+def _load_site_settings():
+    values = dict(db.session.execute(db.select(SiteSetting.key, SiteSetting.value)).all())
+    version = values.pop(SITE_SETTINGS_VERSION_KEY, None)
+    slabs = db.session.execute(db.select(DeliverySlab.max_km, DeliverySlab.fee, DeliverySlab.cost)).all()
+    pricing = DeliveryPricing(slabs or DEFAULT_DELIVERY_SLABS)
+    with _site_settings['lock']:
+        _site_settings.update(values=values, pricing=pricing, version=version, checked_at=time.monotonic())
+    return values
+
+def site_settings():
+    """Returns the raw setting values, reloading them when another worker has saved newer ones."""
+    values = _site_settings['values']
+    if values is None:
+        return _load_site_settings()
+    if time.monotonic() - _site_settings['checked_at'] > SITE_SETTINGS_RECHECK_SECONDS:
+        version = db.session.scalar(db.select(SiteSetting.value).where(SiteSetting.key == SITE_SETTINGS_VERSION_KEY))
+        if version != _site_settings['version']:
+            return _load_site_settings()
+        _site_settings['checked_at'] = time.monotonic()
+    return values
+
+def delivery_pricing():
+    """Returns the cached DeliveryPricing; it reloads together with the site settings."""
+    site_settings()
+    return _site_settings['pricing']
+
+def bump_site_settings_version():
+    """Marks the settings as changed for every worker; commits with the caller's transaction."""
+    bumped = SiteSetting.query.filter_by(key=SITE_SETTINGS_VERSION_KEY).update(
+        {SiteSetting.value: db.cast(db.cast(SiteSetting.value, db.Integer) + 1, db.String)},
+        synchronize_session=False)
+    if not bumped:
+        db.session.add(SiteSetting(key=SITE_SETTINGS_VERSION_KEY, value='1'))
+
+def invalidate_site_settings():
+    with _site_settings['lock']:
+        _site_settings['values'] = None
 
 def get_site_setting(key, default_val, type_func=float):
     """Helper to get a site setting with a default fallback."""
     try:
-        setting = db.session.get(SiteSetting, key)
-        if setting:
-            return type_func(setting.value)
+        value = site_settings().get(key)
+        if value is not None:
+            return type_func(value)
     except Exception:
         pass
     return default_val
 
-def calculate_delivery_charges(distance_km):
-    """Calculates delivery fee and cost based on distance and commission slabs."""
+class DeliveryPricing:
+    """Distance-slab delivery pricing. Slabs are looked up by bisecting their upper bounds;
+    invalid distances are priced at the top slab."""
+    def __init__(self, slabs):
+        bounded = sorted((s for s in slabs if s[0] is not None), key=lambda s: s[0])
+        open_ended = [s for s in slabs if s[0] is None]
+        ordered = bounded + open_ended[:1]
+        self.bounds = [float(s[0]) for s in bounded]
+        self.fees = [float(s[1]) for s in ordered]
+        self.costs = [float(s[2]) for s in ordered]
+
+    def slab_index(self, distance_km):
+        # bisect_left keeps the bounds inclusive: exactly 5 km is priced in the "up to 5 km" slab
+        return min(bisect.bisect_left(self.bounds, distance_km), len(self.fees) - 1)
+
+    def quote(self, distance_km):
+        """Returns (fee, cost) for one distance."""
+        try:
+            distance_km = float(distance_km)
+        except (ValueError, TypeError):
+            return self.fees[-1], self.costs[-1]
+        if distance_km != distance_km:  # NaN
+            return self.fees[-1], self.costs[-1]
+        index = self.slab_index(distance_km)
+        return self.fees[index], self.costs[index]
+
+    def quote_many(self, distances):
+        """Returns (fees, costs) lists for many distances, vectorized with NumPy when it is installed."""
+        np = numpy_module.get()
+        if np is not None:
+            values = np.array([_as_float(d) for d in distances], dtype=float)
+            indexes = np.minimum(np.searchsorted(np.array(self.bounds), values, side='left'), len(self.fees) - 1)
+            indexes[np.isnan(values)] = len(self.fees) - 1
+            return np.array(self.fees)[indexes].tolist(), np.array(self.costs)[indexes].tolist()
+        quotes = [self.quote(d) for d in distances]
+        return [fee for fee, _ in quotes], [cost for _, cost in quotes]
+
+def _as_float(value):
     try:
-        distance_km = float(distance_km)
+        return float(value)
     except (ValueError, TypeError):
-        # Default to a high tier if distance is invalid
-        return 150, 100
-
-    if distance_km <= 5:
-        fee = 40
-        cost = fee - 10  # 30
-    elif distance_km <= 15:
-        fee = 60
-        cost = fee - 20  # 40
-    elif distance_km <= 30:
-        fee = 90
-        cost = fee - 35  # 55
-    else: # For distances > 30km, a higher flat rate
-        fee = 150
-        cost = 100 # 50 profit
-    return fee, cost
+        return float('nan')
+
+def parse_delivery_slabs(max_kms, fees, costs):
+    """Validates slab rows posted from the settings page. Returns a list of (max_km, fee, cost)
+    or raises ValueError. A blank max_km is only allowed on the last row."""
+    slabs = []
+    for max_km, fee, cost in zip(max_kms, fees, costs):
+        if not (max_km.strip() or fee.strip() or cost.strip()):
+            continue
+        bound = float(max_km) if max_km.strip() else None
+        fee, cost = float(fee), float(cost)
+        if fee < 0 or cost < 0 or (bound is not None and bound <= 0):
+            raise ValueError('Slab distances, fees and costs must be positive.')
+        slabs.append((bound, fee, cost))
+    if not slabs:
+        raise ValueError('At least one delivery slab is required.')
+    if any(bound is None for bound, _, _ in slabs[:-1]):
+        raise ValueError('Only the last delivery slab can be open-ended.')
+    bounds = [bound for bound, _, _ in slabs if bound is not None]
+    if any(later <= earlier for earlier, later in zip(bounds, bounds[1:])):
+        raise ValueError('Slab distances must increase from row to row.')
+    return slabs
+
+def calculate_delivery_charges(distance_km):
+    """Calculates delivery fee and cost based on distance and commission slabs."""
+    return delivery_pricing().quote(distance_km)
+
+# Cart store. Every cart mutation calls touch_cart(), which bumps the buyer's
+# user.cart_version in the same transaction; the summary (badge count, subtotal) is
+# cached per version, so a page render costs one primary-key lookup instead of a cart
+# aggregate, and edits from any device or worker are seen on the next request.
+CartSummary = namedtuple('CartSummary', 'lines count subtotal')
+EMPTY_CART_SUMMARY = CartSummary(0, 0, 0)
+_cart_summaries = {'summaries': OrderedDict(), 'lock': threading.Lock()}
+
+def touch_cart(user_id):
+    """Call when changing the buyer's cart so the cached cart summary is recomputed.
+    Commits with the caller's transaction."""
+    users = User.__table__
+    # A Core update on the table, so the admin header stats (which watch User writes) stay cached
+    db.session.execute(db.update(users).where(users.c.id == user_id).values(cart_version=users.c.cart_version + 1))
+
+def cart_totals(user_id):
+    """Computes the buyer's CartSummary from the live cart and prices. Lines whose product
+    was deleted are left out. Payment amounts and quotes use this, not the cached summary."""
+    return CartSummary(*db.session.execute(
+        db.select(db.func.count(Cart.id), db.func.coalesce(db.func.sum(Cart.quantity), 0),
+                  db.func.coalesce(db.func.sum(Product.price * Cart.quantity), 0))
+        .select_from(Cart).join(Product, Cart.product_id == Product.id)
+        .where(Cart.buyer_id == user_id)
+    ).one())
+
+def cart_summary(user_id):
+    """Returns the buyer's CartSummary, cached per cart version. Price edits are picked up
+    when the entry expires, so it is for display only (the navbar badge)."""
+    version = db.session.scalar(db.select(User.cart_version).where(User.id == user_id))
+    key = (user_id, version)
+    now = time.monotonic()
+    with _cart_summaries['lock']:
+        cached = _cart_summaries['summaries'].get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+    summary = cart_totals(user_id)
+    with _cart_summaries['lock']:
+        _cart_summaries['summaries'][key] = (summary, now + CART_SUMMARY_TTL_SECONDS)
+        _cart_summaries['summaries'].move_to_end(key)
+        while len(_cart_summaries['summaries']) > CART_SUMMARY_CACHE_SIZE:
+            _cart_summaries['summaries'].popitem(last=False)
+    return summary
+
+def current_cart_summary():
+    """The logged-in buyer's CartSummary; other visitors have no cart and skip the lookup."""
+    if session.get('user_role') != 'buyer' or 'user_id' not in session:
+        return EMPTY_CART_SUMMARY
+    return cart_summary(session['user_id'])
 
 def log_order_status(order_id, new_status, commit=True):
     """Logs a new status for an order."""
@@ -529,11 +2260,12 @@ def reset_password(token):
 @roles_required('buyer', 'seller', 'admin', 'farmer')
 def product():
     # Normalize category parameter and perform case-insensitive filtering
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 12  # Number of products per page
     category = request.args.get('category', 'all')
     search_query = request.args.get('q', '').strip()
-    sort_by = request.args.get('sort', 'newest')  # Get sort param, default to 'newest'
+    # Get sort param, default to relevance when searching and 'newest' otherwise
+    sort_by = request.args.get('sort', 'relevance' if search_query else 'newest')
     cat_key = (category or 'all').lower()
 
     query = Product.query
@@ -542,51 +2274,28 @@ def product():
         # filter by lowercased category to be tolerant of stored casing
         query = query.filter(db.func.lower(Product.category) == cat_key)
 
+    search_rank = None
     if search_query:
-        query = query.filter(Product.name.ilike(f'%{search_query}%'))
-
-    # Subquery to get average rating and review count for each product
-    avg_rating_subquery = db.session.query(
-        ProductReview.product_id,
-        db.func.avg(ProductReview.rating).label('avg_rating'),
-        db.func.count(ProductReview.id).label('review_count')
-    ).group_by(ProductReview.product_id).subquery()
-
-    # Join the main product query with the subquery
-    query = query.outerjoin(avg_rating_subquery, Product.id == avg_rating_subquery.c.product_id)
+        query, search_rank = apply_product_search(query, search_query)
 
-    # Add sorting logic
+    # Add sorting logic; the id breaks ties so every row has a unique keyset position
     if sort_by == 'price_asc':
-        query = query.order_by(Product.price.asc())
+        keys = [(Product.price, False), (Product.id, False)]
     elif sort_by == 'price_desc':
-        query = query.order_by(Product.price.desc())
+        keys = [(Product.price, True), (Product.id, True)]
     elif sort_by == 'popular':
-        # Order by review count descending, handling NULLs
-        query = query.order_by(db.func.coalesce(avg_rating_subquery.c.review_count, 0).desc())
+        # Order by the denormalized (indexed) review count
+        keys = [(Product.review_count, True), (Product.id, True)]
+    elif sort_by == 'relevance' and search_rank is not None:
+        keys = [(search_rank, False), (Product.created_at, True), (Product.id, True)]
     else:  # 'newest' or default
-        query = query.order_by(Product.created_at.desc())
-
-    pagination = query.add_columns(
-        avg_rating_subquery.c.avg_rating,
-        avg_rating_subquery.c.review_count
-    ).paginate(page=page, per_page=per_page, error_out=False)
-
-    product_data = pagination.items
+        keys = [(Product.created_at, True), (Product.id, True)]
 
-    # Process into a list of product objects with attached rating info
-    products_with_ratings = []
-    for p, avg_rating, review_count in product_data:
-        p.avg_rating = avg_rating or 0
-        p.review_count = review_count or 0
-        products_with_ratings.append(p)
-
-    # Compute cart count for current user (server-side)
-    cart_count = 0
-    if 'user_id' in session:
-        cart_count = db.session.query(db.func.coalesce(db.func.sum(Cart.quantity), 0)).filter(Cart.buyer_id == session['user_id']).scalar() or 0
+    pagination = keyset_paginate(query, keys, per_page, cursor=cursor, with_total=True)
+    products_with_ratings = pagination.items
 
     # pass normalized category key and sort_by for template active state
-    return render_template('product.html', product=products_with_ratings, category=cat_key, cart_count=cart_count, sort_by=sort_by, pagination=pagination)
+    return render_template('product.html', product=products_with_ratings, category=cat_key, sort_by=sort_by, pagination=pagination)
 
 @app.route('/addproduct', methods=['GET', 'POST'])
 @roles_required('seller', 'farmer', 'admin')
@@ -634,17 +2343,19 @@ def add_to_cart(product_id):
     if not product:
         return jsonify({'success': False, 'message': 'Product not found.'}), 404
 
-    # --- Stock Validation ---
-    # Prevent adding more items than are in stock
-    existing_quantity_in_cart = db.session.query(db.func.sum(Cart.quantity)).filter_by(buyer_id=session['user_id'], product_id=product_id).scalar() or 0
-    if existing_quantity_in_cart >= product.quantity:
-        return jsonify({'success': False, 'message': f'No more stock available for "{product.name}".'}), 400
-
     cart_item = Cart.query.filter_by(
         buyer_id=session['user_id'],
         product_id=product_id
     ).first()
 
+    # --- Stock Validation ---
+    # Prevent adding more items than are in stock
+    in_cart = cart_item.quantity if cart_item else 0
+    if in_cart >= product.quantity and reclaim_expired_stock([product_id]):
+        db.session.refresh(product)
+    if in_cart >= product.quantity:
+        return jsonify({'success': False, 'message': f'No more stock available for "{product.name}".'}), 400
+
     if cart_item:
         cart_item.quantity += 1
     else:
@@ -655,10 +2366,12 @@ def add_to_cart(product_id):
         )
         db.session.add(cart_item)
 
+    touch_cart(session['user_id'])
+
     db.session.commit()
 
-    # Get updated cart count
-    new_cart_count = db.session.query(db.func.coalesce(db.func.sum(Cart.quantity), 0)).filter(Cart.buyer_id == session['user_id']).scalar() or 0
+    # The updated summary is cached for the next page render
+    new_cart_count = cart_summary(session['user_id']).count
 
     return jsonify({'success': True, 'message': f'"{product.name}" added to cart!', 'cart_count': new_cart_count})
 
@@ -668,6 +2381,8 @@ def buy_now(product_id):
     product = Product.query.get_or_404(product_id)
     quantity = int(request.form.get('quantity', 1))
 
+    if quantity > product.quantity and reclaim_expired_stock([product_id]):
+        db.session.refresh(product)
     if quantity <= 0 or quantity > product.quantity:
         flash('Invalid quantity or not enough stock.', 'error')
         return redirect(url_for('product_detail', product_id=product_id))
@@ -683,6 +2398,7 @@ def buy_now(product_id):
         quantity=quantity
     )
     db.session.add(new_cart_item)
+    touch_cart(session['user_id'])
     db.session.commit()
     
     flash('Proceed to checkout for your item.', 'info')
@@ -708,7 +2424,8 @@ def get_cart_details(user_id):
             'unit': product.unit,
             'total': item_total,
             'image': product.image,
-            'seller_id': product.seller_id
+            'seller_id': product.seller_id,
+            'category': product.category
         })
     
     return cart_products, total_amount
@@ -717,10 +2434,8 @@ def get_cart_details(user_id):
 @app.context_processor
 def inject_cart_count():
     """Inject `cart_count` into all templates for the navbar badge."""
-    cart_count = 0
     try:
-        if 'user_id' in session:
-            cart_count = db.session.query(db.func.coalesce(db.func.sum(Cart.quantity), 0)).filter(Cart.buyer_id == session['user_id']).scalar() or 0
+        cart_count = current_cart_summary().count
     except Exception:
         cart_count = 0
     return dict(cart_count=cart_count)
@@ -738,14 +2453,18 @@ def update_cart(product_id, action):
     if cart_item:
         if action == 'increase':
             product = db.session.get(Product, product_id)
+            if cart_item.quantity >= product.quantity and reclaim_expired_stock([product_id]):
+                db.session.refresh(product)
             if cart_item.quantity < product.quantity:
                 cart_item.quantity += 1
+                touch_cart(session['user_id'])
                 db.session.commit()
             else:
                 flash(f'Cannot add more. Only {product.quantity} available.', 'warning')
         elif action == 'decrease':
             if cart_item.quantity > 1:
                 cart_item.quantity -= 1
+                touch_cart(session['user_id'])
                 db.session.commit()
     return redirect(url_for('cart'))
 
@@ -753,6 +2472,7 @@ def update_cart(product_id, action):
 @roles_required('buyer')
 def remove_from_cart(product_id):
     Cart.query.filter_by(buyer_id=session['user_id'], product_id=product_id).delete()
+    touch_cart(session['user_id'])
     db.session.commit()
     flash('Item removed from cart.', 'info')
     return redirect(url_for('cart'))
@@ -762,18 +2482,99 @@ def remove_from_cart(product_id):
 @roles_required('buyer')
 def clear_cart():
     Cart.query.filter_by(buyer_id=session['user_id']).delete()
+    touch_cart(session['user_id'])
     db.session.commit()
     flash('Cart cleared.', 'info')
     return redirect(url_for('cart'))
 
+def parse_cart_batch(data):
+    """Validates a cart batch payload. Returns ({product_id: quantity}, error message)."""
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return None, 'Expected a JSON object with an "items" list.'
+    if len(items) > MAX_CART_BATCH_LINES:
+        return None, f'At most {MAX_CART_BATCH_LINES} items per batch.'
+    quantities = {}
+    for item in items:
+        product_id = item.get('product_id') if isinstance(item, dict) else None
+        quantity = item.get('quantity') if isinstance(item, dict) else None
+        # bool is an int subclass; reject it rather than read true as 1
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in (product_id, quantity)) or quantity < 0:
+            return None, 'Each item needs an integer product_id and a quantity of 0 or more.'
+        if product_id in quantities:
+            return None, f'Product {product_id} appears more than once.'
+        quantities[product_id] = quantity
+    return quantities, None
+
+def apply_cart_batch(user_id, quantities, replace=False):
+    """Sets each product's cart quantity (0 removes the line) in one transaction.
+    With replace, lines not in the batch are removed too. Raises StockUnavailable. Caller commits."""
+    wanted = {pid: qty for pid, qty in quantities.items() if qty > 0}
+    if wanted:
+        stock_query = db.select(Product.id, Product.quantity).where(Product.id.in_(list(wanted)))
+        stock = dict(db.session.execute(stock_query).all())
+        short = {pid: max(stock.get(pid, 0), 0) for pid, qty in wanted.items() if stock.get(pid, 0) < qty}
+        if short and release_expired_holds(short):
+            # Units held by abandoned payments were back in stock
+            stock = dict(db.session.execute(stock_query).all())
+            short = {pid: max(stock.get(pid, 0), 0) for pid, qty in wanted.items() if stock.get(pid, 0) < qty}
+        if short:
+            raise StockUnavailable(short)
+
+    lines = Cart.query.filter(Cart.buyer_id == user_id)
+    if not replace:
+        lines = lines.filter(Cart.product_id.in_(list(quantities)))
+    existing, stale = {}, []
+    for line_id, product_id in lines.with_entities(Cart.id, Cart.product_id).order_by(Cart.id):
+        # Duplicate lines for one product collapse into the first
+        if product_id in wanted and product_id not in existing:
+            existing[product_id] = line_id
+        else:
+            stale.append(line_id)
+
+    if stale:
+        Cart.query.filter(Cart.id.in_(stale)).delete(synchronize_session=False)
+    updates = [{'id': existing[pid], 'quantity': qty} for pid, qty in wanted.items() if pid in existing]
+    if updates:
+        db.session.execute(db.update(Cart), updates)
+    inserts = [{'buyer_id': user_id, 'product_id': pid, 'quantity': qty} for pid, qty in wanted.items() if pid not in existing]
+    if inserts:
+        db.session.execute(db.insert(Cart), inserts)
+    touch_cart(user_id)
+
+@app.route('/api/cart/batch', methods=['POST'])
+@roles_required('buyer')
+def api_cart_batch():
+    """Applies a list of {product_id, quantity} changes to the cart atomically and returns
+    the new cart summary. quantity is the line's new total; 0 removes it. With
+    "replace": true the cart is synced to exactly the given items."""
+    data = request.get_json(silent=True)
+    quantities, error = parse_cart_batch(data)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    try:
+        apply_cart_batch(session['user_id'], quantities, replace=bool(data.get('replace')))
+        db.session.commit()
+    except StockUnavailable as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e), 'available': e.short}), 409
+    summary = cart_summary(session['user_id'])
+    return jsonify({'success': True, 'cart': summary._asdict()})
+
 @app.route('/generate_upi_qr')
 @roles_required('buyer')
 def generate_upi_qr():
-    if not qrcode:
+    """Serves the UPI QR for the buyer's cart as PNG or, with ?format=svg, SVG.
+    Images are cached per payload and revalidated with an ETag."""
+    if not qrcode_module.get():
         return "QR Code library not installed", 500
-    
-    cart_products, total_amount = get_cart_details(session['user_id'])
-    if not cart_products:
+    fmt = request.args.get('format', 'png')
+    if fmt not in UPI_QR_FORMATS:
+        return "Unsupported QR format", 400
+
+    summary = cart_totals(session['user_id'])
+    total_amount = summary.subtotal
+    if not summary.lines:
         return "Cart is empty", 400
 
     shipping_fee = get_site_setting('shipping_fee', DEFAULT_SHIPPING_FEE)
@@ -784,12 +2585,16 @@ def generate_upi_qr():
     grand_total = total_amount + shipping + tax
 
     upi_url = f"upi://pay?pa={UPI_ID}&pn=E-Manddi&am={grand_total:.2f}&cu=INR"
-    
-    img = qrcode.make(upi_url)
-    buf = io.BytesIO()
-    img.save(buf, 'PNG')
-    buf.seek(0)
-    return send_file(buf, mimetype='image/png')
+    etag = hashlib.sha1(f'{fmt}:{upi_url}'.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render_upi_qr(upi_url, fmt))
+        response.mimetype = UPI_QR_FORMATS[fmt]
+    response.set_etag(etag)
+    # The URL stays the same while the cart changes, so browsers must revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/calculate_shipping', methods=['POST'])
 def api_calculate_shipping():
@@ -807,7 +2612,7 @@ def api_calculate_shipping():
 
     delivery_fee, _ = calculate_delivery_charges(distance)
     
-    _, total_amount = get_cart_details(session['user_id'])
+    total_amount = cart_totals(session['user_id']).subtotal
     free_shipping_threshold = get_site_setting('free_shipping_threshold', DEFAULT_FREE_SHIPPING_THRESHOLD)
     
     shipping_charge = 0 if total_amount >= free_shipping_threshold else delivery_fee
@@ -848,6 +2653,10 @@ def create_payment():
         shipping_charge = 0 if total_amount >= free_shipping_threshold else delivery_fee
         grand_total = total_amount + shipping_charge
 
+        # Hold the stock while the buyer completes payment
+        hold_cart_stock(session['user_id'], cart_products)
+        db.session.commit()
+
         # Create Razorpay order
         order_amount = int(grand_total * 100)  # Amount in paise
         order_data = {
@@ -857,7 +2666,14 @@ def create_payment():
             'payment_capture': '1'  # Auto capture payment
         }
         
-        razorpay_order = razorpay_client.order.create(order_data)
+        try:
+            razorpay_order = razorpay_client.get().order.create(order_data)
+        except Exception:
+            # Nothing to pay against, so give the held stock back now rather than at expiry
+            db.session.rollback()
+            release_buyer_holds(session['user_id'])
+            db.session.commit()
+            raise
         
         return jsonify({
             'order_id': razorpay_order['id'],
@@ -866,6 +2682,9 @@ def create_payment():
             'user_email': session.get('user_email', 'user@cropify.com'),
             'user_phone': '9999999999'
         })
+    except StockUnavailable as e:
+        db.session.rollback()
+        return jsonify({'error': stock_error_message(e, cart_products)}), 409
     except Exception as e:
         app.logger.error(f"Error creating Razorpay order: {e}")
         return jsonify({'error': str(e)}), 400
@@ -874,18 +2693,22 @@ def _process_order_items_and_stock(user_id, new_order, cart_products):
     """
     Helper function to:
     1. Create OrderItem entries for an order.
-    2. Decrease product stock.
+    2. Decrease product stock atomically, consuming the buyer's stock hold.
     3. Delete products if stock runs out.
     4. Clear the user's cart.
+    5. Record the order in the daily sales rollup.
     """
     commission_rate = get_site_setting('commission_rate', DEFAULT_COMMISSION_RATE)
     seller_items_map = {} # Map seller_id to list of product names for notification
 
+    order_items = []
     for item in cart_products:
         item_total = item['price'] * item['quantity']
-        commission = item_total * commission_rate
-        order_item = OrderItem(order_id=new_order.id, product_id=item['id'], seller_id=item['seller_id'], product_name=item['name'], price=item['price'], quantity=item['quantity'], commission_amount=commission)
-        db.session.add(order_item)
+        order_items.append({
+            'order_id': new_order.id, 'product_id': item['id'], 'seller_id': item['seller_id'],
+            'product_name': item['name'], 'category': item['category'], 'price': item['price'], 'quantity': item['quantity'],
+            'commission_amount': item_total * commission_rate, 'is_paid_to_seller': False
+        })
 
         # Group items by seller for notification
         sid = item['seller_id']
@@ -893,24 +2716,42 @@ def _process_order_items_and_stock(user_id, new_order, cart_products):
             seller_items_map[sid] = []
         seller_items_map[sid].append(f"{item['name']} (Qty: {item['quantity']})")
 
-    cart_items = db.session.query(Cart).filter_by(buyer_id=user_id).all()
-    for item in cart_items:
-        product = db.session.get(Product, item.product_id)
-        if product:
-            product.quantity -= item.quantity
-            if product.quantity <= 0:
-                app.logger.info(f'Product "{product.name}" (ID: {product.id}) ran out of stock and was deleted.')
-                db.session.delete(product)
+    # Insert every line with a single executemany
+    if order_items:
+        db.session.execute(db.insert(OrderItem), order_items)
+
+    # Atomic, all-or-nothing stock decrement (raises StockUnavailable)
+    commit_order_stock(user_id, cart_products)
     # Clear cart after processing stock
     Cart.query.filter_by(buyer_id=user_id).delete()
+    touch_cart(user_id)
+
+    record_order_in_rollup(new_order, cart_products)
 
     # Send notifications to sellers
-    for sid, products_list in seller_items_map.items():
-        seller = db.session.get(User, sid)
-        if seller and seller.phone:
+    sellers = User.query.filter(User.id.in_(list(seller_items_map)), User.phone.isnot(None)).all() if seller_items_map else []
+    for seller in sellers:
+        products_list = seller_items_map[seller.id]
+        if seller.phone:
             product_str = ", ".join(products_list)
             msg = f"New Order! You have sold: {product_str}. Check your dashboard."
-            send_sms(seller.phone, msg)
+            queue_sms(seller.phone, msg, commit=False)
+
+def razorpay_signature_valid(data):
+    """Checks a checkout's Razorpay signature through the lazily loaded client."""
+    client = razorpay_client.get()
+    try:
+        client.utility.verify_payment_signature({
+            'razorpay_order_id': data['razorpay_order_id'],
+            'razorpay_payment_id': data['razorpay_payment_id'],
+            'razorpay_signature': data['razorpay_signature']
+        })
+    except Exception as e:
+        from razorpay.errors import SignatureVerificationError  # already loaded by the client
+        if isinstance(e, SignatureVerificationError):
+            return False
+        raise
+    return True
 
 @app.route('/verify-payment', methods=['POST'])
 @roles_required('buyer')
@@ -924,11 +2765,9 @@ def verify_payment():
             return jsonify({'error': 'Payment verification is not configured'}), 500
         
         # Verify payment signature
-        razorpay_client.utility.verify_payment_signature({
-            'razorpay_order_id': data['razorpay_order_id'],
-            'razorpay_payment_id': data['razorpay_payment_id'],
-            'razorpay_signature': data['razorpay_signature']
-        })
+        if not razorpay_signature_valid(data):
+            app.logger.warning("Razorpay signature verification failed.")
+            return jsonify({'error': 'Payment verification failed'}), 400
         
         # Payment verified - get cart details
         # We get details *before* clearing the cart
@@ -968,17 +2807,50 @@ def verify_payment():
         flash('Payment successful! Order placed.', 'success')
         buyer = db.session.get(User, session['user_id'])
         if buyer and buyer.phone:
-            send_sms(buyer.phone, f'Payment received. Order #{new_order.id} placed')
+            queue_sms(buyer.phone, f'Payment received. Order #{new_order.id} placed')
         return jsonify({'success': True, 'order_id': new_order.id})
     
-    except razorpay.errors.SignatureVerificationError:
-        app.logger.warning("Razorpay signature verification failed.")
-        return jsonify({'error': 'Payment verification failed'}), 400
+    except StockUnavailable as e:
+        db.session.rollback()
+        app.logger.error(f"Stock unavailable after payment {data['razorpay_payment_id']}: {e}")
+        refunded = refund_unfulfilled_payment(session['user_id'], data['razorpay_payment_id'], grand_total,
+                                              shipping_address, str(e))
+        message = stock_error_message(e, cart_products)
+        message += (' Your payment has been refunded.' if refunded
+                    else ' Your payment is recorded and our team will refund it shortly.')
+        return jsonify({'error': message, 'refunded': refunded}), 409
     except Exception as e:
+        db.session.rollback()
         app.logger.error(f"Error verifying payment: {e}")
         return jsonify({'error': str(e)}), 400
     
     
+def refund_unfulfilled_payment(user_id, payment_id, amount, shipping_address, reason):
+    """Refunds a captured payment whose order could not be placed. If the refund fails, the
+    payment is saved as a 'Payment Review' order so an admin can reconcile it.
+    Returns True when the refund went through."""
+    buyer = db.session.get(User, user_id)
+    try:
+        razorpay_client.get().payment.refund(payment_id, {'notes': {'reason': reason[:250]}})
+    except Exception as e:
+        app.logger.error(f"Refund of payment {payment_id} failed, saving it for review: {e}")
+        order = Order(buyer_id=user_id, total_amount=amount, payment_mode='Razorpay',
+                      shipping_address=shipping_address, status='Payment Review')
+        db.session.add(order)
+        db.session.flush()
+        log_order_status(order.id, order.status, commit=False)
+        # Counted like any other order, as rebuild_daily_sales_rollup() would; it has no items
+        record_order_in_rollup(order, [])
+        db.session.add(OrderNote(order_id=order.id, author_id=user_id, is_public=False,
+                                 note_text=f'Payment {payment_id} captured but not fulfilled ({reason}). Refund failed: {e}'))
+        if buyer and buyer.phone:
+            queue_sms(buyer.phone, f'We could not fulfil your order. Payment {payment_id} will be refunded shortly.', commit=False)
+        db.session.commit()
+        return False
+    if buyer and buyer.phone:
+        queue_sms(buyer.phone, f'We could not fulfil your order. Payment {payment_id} has been refunded.')
+    return True
+
 @app.route('/checkout', methods=['GET', 'POST'])
 @roles_required('buyer')
 def checkout():
@@ -1035,12 +2907,18 @@ def checkout():
             db.session.add(new_order)
             db.session.flush()
             log_order_status(new_order.id, new_order.status, commit=False)
-            _process_order_items_and_stock(session['user_id'], new_order, cart_products)
+            try:
+                _process_order_items_and_stock(session['user_id'], new_order, cart_products)
+            except StockUnavailable as e:
+                db.session.rollback()
+                flash(stock_error_message(e, cart_products), 'error')
+                return redirect(url_for('cart'))
             db.session.commit()
             flash('Order placed successfully!', 'success')
             return redirect(url_for('orderconformation', order_id=new_order.id))
-    
-    return render_template('checkout.html', cart_product=cart_products, total_amount=total_amount, shipping_charge=shipping_charge, grand_total=grand_total, upi_qr_url=url_for('generate_upi_qr'), upi_id=UPI_ID)
+    # Stock is held only once the buyer commits to paying (create_payment), or taken
+    # directly when a COD/UPI order is placed, so viewing this page reserves nothing
+    return render_template('checkout.html', cart_product=cart_products, total_amount=total_amount, shipping_charge=shipping_charge, grand_total=grand_total, upi_qr_url=url_for('generate_upi_qr', format='svg'), upi_id=UPI_ID)
 
 @app.route('/my_orders')
 @roles_required('buyer')
@@ -1135,22 +3013,27 @@ def thankyou():
 
 @app.route('/admin')
 @roles_required('admin')
+@read_replica
 def admin():
     today = datetime.now().date()
     current_month = today.month
 
+    # Last 7 days of pre-aggregated sales in a single range query
+    week_start = today - timedelta(days=6)
+    yesterday = today - timedelta(days=1)
+    rollup = get_daily_rollup(week_start, today)
+
+    def rollup_value(day, group, column):
+        row = rollup.get((day, group))
+        return getattr(row, column) if row else 0
+
     # Today's orders and sales
-    today_orders = Order.query.filter(db.func.date(Order.created_at) == today).all()
-    today_orders_count = Order.query.filter(db.func.date(Order.created_at) == today).count()
-    today_sales = sum(order.total_amount for order in today_orders)
+    today_orders_count = rollup_value(today, 'all', 'order_count')
+    today_sales = rollup_value(today, 'all', 'total_amount')
     # Yesterday's sales (for comparison)
-    yesterday = today - timedelta(days=1)
-    yesterday_sales = db.session.query(db.func.sum(Order.total_amount)).filter(db.func.date(Order.created_at) == yesterday).scalar() or 0
-    # All-time stats
-    total_orders_count = Order.query.count()
-    total_sales = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
-    total_users_count = User.query.count()
-    total_products_count = Product.query.count()
+    yesterday_sales = rollup_value(yesterday, 'all', 'total_amount')
+    # All-time stats, shared with the other admin pages
+    header_stats = get_admin_header_stats()
 
     # Calculate delivery earnings (Profit from logistics)
     total_delivery_earnings = db.session.query(db.func.sum(Order.delivery_fee - Order.delivery_cost)).scalar() or 0
@@ -1182,37 +3065,15 @@ def admin():
     delivery_cost_values = []
     produce_sales_values = []
     supplies_sales_values = []
-    produce_cats = ['fruits', 'vegetables', 'grains', 'dairy']
-    supplies_cats = ['seeds', 'fertilizers', 'pesticides', 'tools', 'machinery']
 
     for i in range(7):
         day = today - timedelta(days=i)
-        day_sales = db.session.query(db.func.sum(Order.total_amount)).filter(db.func.date(Order.created_at) == day).scalar() or 0
         sales_labels.insert(0, day.strftime('%b %d'))
-        sales_values.insert(0, day_sales)
-        
-        day_shipping = db.session.query(db.func.sum(Order.delivery_fee)).filter(db.func.date(Order.created_at) == day).scalar() or 0
-        day_cost = db.session.query(db.func.sum(Order.delivery_cost)).filter(db.func.date(Order.created_at) == day).scalar() or 0
-        shipping_revenue_values.insert(0, day_shipping)
-        delivery_cost_values.insert(0, day_cost)
-
-        # Calculate Produce Sales
-        day_produce_sales = db.session.query(db.func.sum(OrderItem.price * OrderItem.quantity))\
-            .join(Product, OrderItem.product_id == Product.id)\
-            .join(Order, OrderItem.order_id == Order.id)\
-            .filter(db.func.date(Order.created_at) == day)\
-            .filter(Product.category.in_(produce_cats))\
-            .scalar() or 0
-        produce_sales_values.insert(0, day_produce_sales)
-
-        # Calculate Supplies Sales
-        day_supplies_sales = db.session.query(db.func.sum(OrderItem.price * OrderItem.quantity))\
-            .join(Product, OrderItem.product_id == Product.id)\
-            .join(Order, OrderItem.order_id == Order.id)\
-            .filter(db.func.date(Order.created_at) == day)\
-            .filter(Product.category.in_(supplies_cats))\
-            .scalar() or 0
-        supplies_sales_values.insert(0, day_supplies_sales)
+        sales_values.insert(0, rollup_value(day, 'all', 'total_amount'))
+        shipping_revenue_values.insert(0, rollup_value(day, 'all', 'delivery_fee'))
+        delivery_cost_values.insert(0, rollup_value(day, 'all', 'delivery_cost'))
+        produce_sales_values.insert(0, rollup_value(day, 'produce', 'item_sales'))
+        supplies_sales_values.insert(0, rollup_value(day, 'supplies', 'item_sales'))
     
     sales_by_month = {
         'labels': sales_labels,
@@ -1229,18 +3090,18 @@ def admin():
     # Weekly and Monthly totals
     week_sales = sum(sales_values)
     # Month: sum orders where month == current month and year == current year
-    month_sales = db.session.query(db.func.sum(Order.total_amount)).filter(db.extract('month', Order.created_at) == today.month, db.extract('year', Order.created_at) == today.year).scalar() or 0
-
-    # Pending orders
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
+    month_sales = db.session.query(db.func.sum(DailySalesRollup.total_amount)).filter(
+        DailySalesRollup.category_group == 'all',
+        DailySalesRollup.day >= bucket_start(today, 'month'),
+        DailySalesRollup.day <= today
+    ).scalar() or 0
 
     # Pending user approvals
     pending_approvals_count = User.query.filter_by(is_approved=False).count()
 
-    # Low stock alerts (threshold = 5)
-    low_stock_threshold = 5
+    # Low stock alerts
+    low_stock_threshold = LOW_STOCK_THRESHOLD
     low_stock_products = Product.query.filter(Product.quantity <= low_stock_threshold).order_by(Product.quantity.asc()).all()
-    low_stock_count = Product.query.filter(Product.quantity <= low_stock_threshold).count()
 
     # Get recent users and feedback for "Recent Users" table (limited)
     recent_users = User.query.order_by(User.created_at.desc()).limit(5).all() # This is fine
@@ -1276,10 +3137,6 @@ def admin():
         'admin.html',
         today_sales=today_sales,
         today_orders_count=today_orders_count,
-        total_sales=total_sales,
-        total_orders_count=total_orders_count,
-        total_users_count=total_users_count,
-        total_products_count=total_products_count,
         total_delivery_earnings=total_delivery_earnings,
         total_platform_earnings=total_platform_earnings,
         recent_orders=recent_orders,
@@ -1298,30 +3155,24 @@ def admin():
         supplies_sales_values=supplies_sales_values,
         week_sales=week_sales,
         month_sales=month_sales,
-        pending_orders_count=pending_orders_count,
         pending_approvals_count=pending_approvals_count,
-        low_stock_count=low_stock_count,
         low_stock_products=low_stock_products,
         low_stock_threshold=low_stock_threshold,
         yesterday_sales=yesterday_sales,
         current_year=current_year,
         current_time=current_time,
         total_pending_payouts=total_pending_payouts,
-        active_page='dashboard'
+        active_page='dashboard',
+        **header_stats
     )
     
 @app.route('/admin/orders')
 @roles_required('admin')
 def admin_orders():
     """Dedicated page for viewing and managing all orders."""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 15
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
-    low_stock_count = Product.query.filter(Product.quantity <= 5).count()
-    total_sales = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
-    total_orders_count = Order.query.count()
-    total_users_count = User.query.count()
-    total_products_count = Product.query.count()
+    header_stats = get_admin_header_stats()
     delivery_person_filter = request.args.get('delivery_person', type=int)
 
     # Query with pagination
@@ -1333,7 +3184,8 @@ def admin_orders():
     if delivery_person_filter:
         orders_query = orders_query.filter(Order.delivery_person_id == delivery_person_filter)
 
-    orders_pagination = orders_query.order_by(Order.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    orders_pagination = keyset_paginate(orders_query, [(Order.created_at, True), (Order.id, True)], per_page,
+                                        cursor=cursor, with_total=True)
 
     # Fetch active delivery persons for the assignment modal
     delivery_persons = DeliveryPerson.query.filter_by(is_active=True).order_by(DeliveryPerson.name).all()
@@ -1343,12 +3195,7 @@ def admin_orders():
                            delivery_persons=delivery_persons,
                            delivery_person_filter=delivery_person_filter,
                            active_page='orders',
-                           pending_orders_count=pending_orders_count,
-                           low_stock_count=low_stock_count,
-                           total_sales=total_sales,
-                           total_orders_count=total_orders_count,
-                           total_users_count=total_users_count,
-                           total_products_count=total_products_count)
+                           **header_stats)
 
 @app.route('/admin/assign_delivery_person/<int:order_id>', methods=['POST'])
 @roles_required('admin')
@@ -1373,59 +3220,31 @@ def assign_delivery_person(order_id):
     if person.phone:
         buyer = User.query.get(order.buyer_id)
         message = f"New delivery: Order #{order.id} for {buyer.name}. Address: {order.shipping_address}. Amount: Rs.{order.total_amount:.2f}"
-        send_sms(person.phone, message)
+        queue_sms(person.phone, message)
 
     return jsonify({'success': True, 'message': f'{person.name} assigned to order #{order.id}.', 'person_name': person.name})
 
 @app.route('/admin/analytics')
 @roles_required('admin')
+@read_replica
 def admin_analytics():
     """Dedicated page for more detailed analytics."""
     period = request.args.get('period', 'monthly')  # Default to 'monthly'
     today = datetime.now().date()
     
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
-    low_stock_count = Product.query.filter(Product.quantity <= 5).count()
-    total_sales = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
-    total_orders_count = Order.query.count()
-    total_users_count = User.query.count()
-    total_products_count = Product.query.count()
+    header_stats = get_admin_header_stats()
 
-    sales_labels = []
-    sales_values = []
-
-    if period == 'weekly':
-        # Sales data for the last 7 days
-        for i in range(7):
-            day = today - timedelta(days=i)
-            day_sales = db.session.query(db.func.sum(Order.total_amount)).filter(db.func.date(Order.created_at) == day).scalar() or 0
-            sales_labels.insert(0, day.strftime('%a, %b %d'))
-            sales_values.insert(0, day_sales)
-    elif period == 'yearly':
-        # Sales data for the last 12 months
-        current_year = today.year
-        current_month = today.month
-        for i in range(12):
-            month = current_month - i
-            year = current_year
-            if month <= 0:
-                month += 12
-                year -= 1
-            
-            month_sales = db.session.query(db.func.sum(Order.total_amount)).filter(
-                db.extract('year', Order.created_at) == year,
-                db.extract('month', Order.created_at) == month
-            ).scalar() or 0
-            
-            month_date = datetime(year, month, 1)
-            sales_labels.insert(0, month_date.strftime('%b %Y'))
-            sales_values.insert(0, month_sales)
-    else:  # Default to 'monthly' (last 30 days)
-        for i in range(30):
-            day = today - timedelta(days=i)
-            day_sales = db.session.query(db.func.sum(Order.total_amount)).filter(db.func.date(Order.created_at) == day).scalar() or 0
-            sales_labels.insert(0, day.strftime('%b %d'))
-            sales_values.insert(0, day_sales)
+    # period -> (bucket, number of buckets, label format)
+    periods = {
+        'weekly': ('day', 7, '%a, %b %d'),
+        'yearly': ('month', 12, '%b %Y'),
+        'monthly': ('day', 30, '%b %d'),
+    }
+    bucket, count, label_format = periods.get(period, periods['monthly'])
+    starts = last_buckets(bucket, count, today)
+    rollup = get_daily_rollup(starts[0], today)
+    sales_labels = [start.strftime(label_format) for start in starts]
+    sales_values = rollup_series(rollup, starts, bucket, 'all', 'total_amount')
 
     # Category distribution
     categories = db.session.query(Product.category, db.func.count(Product.id)).group_by(Product.category).all()
@@ -1440,33 +3259,23 @@ def admin_analytics():
                            products_by_category=products_by_category,
                            period=period,
                            active_page='analytics',
-                           pending_orders_count=pending_orders_count,
-                           low_stock_count=low_stock_count,
-                           total_sales=total_sales,
-                           total_orders_count=total_orders_count,
-                           total_users_count=total_users_count,
-                           total_products_count=total_products_count)
+                           **header_stats)
 
 @app.route('/admin/products')
 @roles_required('admin')
 def admin_products():
     """Dedicated page for viewing and managing all products."""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 15
-    low_stock_threshold = 5
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
-    total_sales = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
-    total_orders_count = Order.query.count()
-    total_users_count = User.query.count()
-    total_products_count = Product.query.count()
-    low_stock_count = Product.query.filter(Product.quantity <= low_stock_threshold).count()
+    low_stock_threshold = LOW_STOCK_THRESHOLD
+    header_stats = get_admin_header_stats()
     search_query = request.args.get('q', '').strip()
     filter_type = request.args.get('filter', 'all')
 
     # Query with pagination
     query = Product.query
     if search_query:
-        query = query.filter(Product.name.ilike(f'%{search_query}%'))
+        query, _ = apply_product_search(query, search_query)
     
     # Apply category filter
     if filter_type == 'produce':
@@ -1474,7 +3283,8 @@ def admin_products():
     elif filter_type == 'supplies':
         query = query.filter(Product.category.in_(['seeds', 'fertilizers', 'pesticides', 'tools', 'machinery']))
     
-    products_pagination = query.order_by(Product.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    products_pagination = keyset_paginate(query, [(Product.created_at, True), (Product.id, True)], per_page,
+                                          cursor=cursor, with_total=True)
     
     # Prepare data for JavaScript
     products_data = [
@@ -1491,12 +3301,7 @@ def admin_products():
         products_data=products_data,
         low_stock_threshold=low_stock_threshold,
         active_page='products',
-        pending_orders_count=pending_orders_count,
-        low_stock_count=low_stock_count,
-        total_sales=total_sales,
-        total_orders_count=total_orders_count,
-        total_users_count=total_users_count,
-        total_products_count=total_products_count,
+        **header_stats,
         search_query=search_query,
         filter_type=filter_type
     )
@@ -1505,14 +3310,9 @@ def admin_products():
 @roles_required('admin')
 def admin_users():
     """Dedicated page for viewing and managing all users."""
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 15
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
-    low_stock_count = Product.query.filter(Product.quantity <= 5).count()
-    total_sales = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
-    total_orders_count = Order.query.count()
-    total_users_count = User.query.count()
-    total_products_count = Product.query.count()
+    header_stats = get_admin_header_stats()
     search_query = request.args.get('q', '').strip()
 
     # Query with pagination
@@ -1520,7 +3320,8 @@ def admin_users():
     if search_query:
         query = query.filter(db.or_(User.name.ilike(f'%{search_query}%'), User.email.ilike(f'%{search_query}%')))
         
-    users_pagination = query.order_by(User.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    users_pagination = keyset_paginate(query, [(User.created_at, True), (User.id, True)], per_page,
+                                       cursor=cursor, with_total=True)
     
     # Prepare data for JavaScript
     users_data = [
@@ -1537,13 +3338,8 @@ def admin_users():
                            users_pagination=users_pagination, 
                            users_data=users_data,
                            active_page='users',
-                           pending_orders_count=pending_orders_count,
-                           low_stock_count=low_stock_count,
-                           total_sales=total_sales,
-                           total_orders_count=total_orders_count,
-                           total_users_count=total_users_count,
-                           total_products_count=total_products_count,
-                           search_query=search_query)
+                           search_query=search_query,
+                           **header_stats)
 
 @app.route('/admin/approve_user/<int:user_id>', methods=['POST'])
 @roles_required('admin')
@@ -1553,7 +3349,7 @@ def admin_approve_user(user_id):
     db.session.commit()
     
     if user.phone:
-        send_sms(user.phone, "Your account has been approved! You can now log in and start selling.")
+        queue_sms(user.phone, "Your account has been approved! You can now log in and start selling.")
     
     flash(f'User {user.name} approved successfully.', 'success')
     return redirect(url_for('admin_users'))
@@ -1562,12 +3358,7 @@ def admin_approve_user(user_id):
 @roles_required('admin')
 def admin_categories():
     """Dedicated page for viewing product categories."""
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
-    low_stock_count = Product.query.filter(Product.quantity <= 5).count()
-    total_sales = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
-    total_orders_count = Order.query.count()
-    total_users_count = User.query.count()
-    total_products_count = Product.query.count()
+    header_stats = get_admin_header_stats()
     # Query to get category name and count of products in it
     categories = db.session.query(
         Product.category, 
@@ -1577,12 +3368,7 @@ def admin_categories():
     return render_template('admin_categories.html', 
                            categories=categories, 
                            active_page='categories',
-                           pending_orders_count=pending_orders_count,
-                           low_stock_count=low_stock_count,
-                           total_sales=total_sales,
-                           total_orders_count=total_orders_count,
-                           total_users_count=total_users_count,
-                           total_products_count=total_products_count)
+                           **header_stats)
 
 @app.route('/admin/settings', methods=['GET', 'POST'])
 @roles_required('admin')
@@ -1622,38 +3408,37 @@ def admin_settings():
             except (ValueError, TypeError):
                 flash('Invalid commission rate. Please enter a number.', 'error')
 
+        if 'slab_fee' in request.form:
+            try:
+                slabs = parse_delivery_slabs(request.form.getlist('slab_max_km'), request.form.getlist('slab_fee'),
+                                             request.form.getlist('slab_cost'))
+                DeliverySlab.query.delete()
+                db.session.add_all([DeliverySlab(max_km=max_km, fee=fee, cost=cost) for max_km, fee, cost in slabs])
+            except ValueError as e:
+                flash(f'Delivery slabs not saved: {e}', 'error')
+
+        bump_site_settings_version()
         db.session.commit()
+        invalidate_site_settings()
         flash('Settings updated successfully!', 'success')
         return redirect(url_for('admin_settings'))
 
-    settings = {s.key: s.value for s in SiteSetting.query.all()}
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
-    low_stock_count = Product.query.filter(Product.quantity <= 5).count()
-    return render_template('admin_settings.html', settings=settings, active_page='settings',
-                           pending_orders_count=pending_orders_count,
-                           low_stock_count=low_stock_count)
+    settings = {s.key: s.value for s in SiteSetting.query.filter(SiteSetting.key != SITE_SETTINGS_VERSION_KEY)}
+    delivery_slabs = DeliverySlab.query.order_by(DeliverySlab.max_km.is_(None), DeliverySlab.max_km).all()
+    return render_template('admin_settings.html', settings=settings, delivery_slabs=delivery_slabs, active_page='settings',
+                           **get_admin_header_stats())
 
 @app.route('/admin/reviews')
 @roles_required('admin')
 def admin_reviews():
     """Dedicated page for viewing all feedback/reviews."""
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
-    low_stock_count = Product.query.filter(Product.quantity <= 5).count()
-    total_sales = db.session.query(db.func.sum(Order.total_amount)).scalar() or 0
-    total_orders_count = Order.query.count()
-    total_users_count = User.query.count()
-    total_products_count = Product.query.count()
+    header_stats = get_admin_header_stats()
     reviews = db.session.query(Feedback, User.name.label('user_name')).join(User, Feedback.buyer_id == User.id).order_by(Feedback.created_at.desc()).all()
     
     return render_template('admin_reviews.html', 
                            reviews=reviews, 
                            active_page='reviews',
-                           pending_orders_count=pending_orders_count,
-                           low_stock_count=low_stock_count,
-                           total_sales=total_sales,
-                           total_orders_count=total_orders_count,
-                           total_users_count=total_users_count,
-                           total_products_count=total_products_count)
+                           **header_stats)
 
 
 @app.route('/admin/remove_user/<int:user_id>', methods=['POST'])
@@ -1729,6 +3514,7 @@ def admin_edit_product(product_id):
 
 @app.route('/admin/api/chart-data')
 @roles_required('admin')
+@read_replica
 def admin_chart_data():
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
@@ -1740,48 +3526,11 @@ def admin_chart_data():
         end_date = datetime.now().date()
         start_date = end_date - timedelta(days=6)
 
-    # Helper to get dict of date->value
-    def get_daily_sums(query):
-        results = query.group_by(db.func.date(Order.created_at)).all()
-        return {str(r[0]): r[1] for r in results}
+    rollup = get_daily_rollup(start_date, end_date)
 
-    # Sales
-    sales_query = db.session.query(
-        db.func.date(Order.created_at),
-        db.func.sum(Order.total_amount)
-    ).filter(
-        db.func.date(Order.created_at) >= start_date,
-        db.func.date(Order.created_at) <= end_date
-    )
-    sales_map = get_daily_sums(sales_query)
-
-    # Produce
-    produce_cats = ['fruits', 'vegetables', 'grains', 'dairy']
-    produce_query = db.session.query(
-        db.func.date(Order.created_at),
-        db.func.sum(OrderItem.price * OrderItem.quantity)
-    ).join(Product, OrderItem.product_id == Product.id)\
-     .join(Order, OrderItem.order_id == Order.id)\
-     .filter(
-        db.func.date(Order.created_at) >= start_date,
-        db.func.date(Order.created_at) <= end_date,
-        Product.category.in_(produce_cats)
-    )
-    produce_map = get_daily_sums(produce_query)
-
-    # Supplies
-    supplies_cats = ['seeds', 'fertilizers', 'pesticides', 'tools', 'machinery']
-    supplies_query = db.session.query(
-        db.func.date(Order.created_at),
-        db.func.sum(OrderItem.price * OrderItem.quantity)
-    ).join(Product, OrderItem.product_id == Product.id)\
-     .join(Order, OrderItem.order_id == Order.id)\
-     .filter(
-        db.func.date(Order.created_at) >= start_date,
-        db.func.date(Order.created_at) <= end_date,
-        Product.category.in_(supplies_cats)
-    )
-    supplies_map = get_daily_sums(supplies_query)
+    def rollup_value(day, group, column):
+        row = rollup.get((day, group))
+        return getattr(row, column) if row else 0
 
     labels = []
     sales_values = []
@@ -1791,11 +3540,10 @@ def admin_chart_data():
     delta = (end_date - start_date).days + 1
     for i in range(delta):
         day = start_date + timedelta(days=i)
-        day_str = str(day)
         labels.append(day.strftime('%b %d'))
-        sales_values.append(sales_map.get(day_str, 0))
-        produce_values.append(produce_map.get(day_str, 0))
-        supplies_values.append(supplies_map.get(day_str, 0))
+        sales_values.append(rollup_value(day, 'all', 'total_amount'))
+        produce_values.append(rollup_value(day, 'produce', 'item_sales'))
+        supplies_values.append(rollup_value(day, 'supplies', 'item_sales'))
 
     return jsonify({
         'labels': labels,
@@ -1804,6 +3552,30 @@ def admin_chart_data():
         'supplies': supplies_values
     })
 
+@app.route('/admin/api/delivery_quotes', methods=['POST'])
+@roles_required('admin')
+def admin_delivery_quotes():
+    """Prices many deliveries at once. Body: {"distances": [...]} or
+    {"orders": [{"distance": km, "subtotal": amount}, ...]}; orders also get the free shipping rule applied."""
+    data = request.get_json() or {}
+    orders = data.get('orders')
+    if orders is not None and not (isinstance(orders, list) and all(isinstance(o, dict) for o in orders)):
+        return jsonify({'success': False, 'error': 'orders must be a list of objects'}), 400
+    distances = [o.get('distance') for o in orders] if orders is not None else data.get('distances')
+    if not isinstance(distances, list) or not distances:
+        return jsonify({'success': False, 'error': 'Provide a non-empty distances or orders list'}), 400
+    if len(distances) > MAX_BULK_QUOTES:
+        return jsonify({'success': False, 'error': f'At most {MAX_BULK_QUOTES} quotes per request'}), 400
+
+    fees, costs = delivery_pricing().quote_many(distances)
+    quotes = [{'distance': d, 'fee': fee, 'cost': cost} for d, fee, cost in zip(distances, fees, costs)]
+    if orders is not None:
+        free_shipping_threshold = get_site_setting('free_shipping_threshold', DEFAULT_FREE_SHIPPING_THRESHOLD)
+        for quote, order in zip(quotes, orders):
+            subtotal = _as_float(order.get('subtotal', 0))
+            quote['shipping_charge'] = 0 if subtotal >= free_shipping_threshold else quote['fee']
+    return jsonify({'success': True, 'quotes': quotes})
+
 @app.route('/admin/update_order_status/<int:order_id>', methods=['POST'])
 @roles_required('admin')
 def admin_update_order_status(order_id):
@@ -1816,10 +3588,10 @@ def admin_update_order_status(order_id):
         db.session.commit()
         buyer = User.query.get(order.buyer_id)
         if buyer and buyer.phone and new_status in ['Shipped', 'Delivered']:
-            send_sms(buyer.phone, f'Update: Your Order #{order_id} has been {new_status}.')
+            queue_sms(buyer.phone, f'Update: Your Order #{order_id} has been {new_status}.')
         elif buyer and buyer.phone:
              # Generic update for other statuses
-             send_sms(buyer.phone, f'Order #{order_id} status updated to {new_status}')
+             queue_sms(buyer.phone, f'Order #{order_id} status updated to {new_status}')
         return jsonify({'success': True, 'message': f'Order #{order_id} status updated to {new_status}.'})
     return jsonify({'success': False, 'error': 'Invalid status provided.'}), 400
 
@@ -1827,35 +3599,125 @@ def admin_update_order_status(order_id):
 @roles_required('admin')
 def admin_send_promotion():
     data = request.get_json() or {}
-    message = data.get('message')
+    message = (data.get('message') or '').strip()
     if not message:
         return jsonify({'success': False, 'error': 'No message provided'}), 400
 
-    # Minimal implementation: log the message and pretend to send to users
+    channels = data.get('channels') or ['sms', 'email']
+    audience = data.get('audience', 'all')
+    if not set(channels) <= {'sms', 'email'} or audience not in PROMOTION_AUDIENCES:
+        return jsonify({'success': False, 'error': 'Invalid channels or audience'}), 400
+
     try:
-        # In a real app: queue emails/notifications here
-        print(f"[ADMIN PROMO] Message to users: {message}")
-        return jsonify({'success': True, 'message': 'Promotion scheduled'}), 200
+        campaign = PromotionCampaign(message=message, subject=data.get('subject') or 'Offers from Cropify',
+                                     channels=','.join(sorted(set(channels))), audience=audience,
+                                     created_by=session.get('user_id'))
+        db.session.add(campaign)
+        db.session.commit()
+        start_promotion_campaign(campaign.id)
+        return jsonify({'success': True, 'message': 'Promotion scheduled', 'campaign_id': campaign.id}), 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/admin/promotions')
+@roles_required('admin')
+def admin_promotions():
+    campaigns = PromotionCampaign.query.order_by(PromotionCampaign.id.desc()).limit(20).all()
+    return jsonify({'campaigns': [campaign_progress(c) for c in campaigns]})
+
+@app.route('/admin/promotions/<int:campaign_id>')
+@roles_required('admin')
+def admin_promotion_progress(campaign_id):
+    campaign = PromotionCampaign.query.get_or_404(campaign_id)
+    return jsonify(campaign_progress(campaign))
+
 
 @app.route('/admin/export_report')
 @roles_required('admin')
 def admin_export_report():
-    # Export basic orders report as CSV
-    import io, csv
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['order_id', 'buyer_id', 'total_amount', 'status', 'created_at'])
-    for o in orders:
-        writer.writerow([o.id, o.buyer_id, o.total_amount, o.status, o.created_at.isoformat()])
-    output.seek(0)
-    mem = io.BytesIO()
-    mem.write(output.getvalue().encode('utf-8'))
-    mem.seek(0)
-    return send_file(mem, mimetype='text/csv', as_attachment=True, download_name='orders_report.csv')
+    """Streams the orders report. Query parameters: start/end (YYYY-MM-DD, inclusive),
+    status (comma-separated), seller_id, columns (comma-separated), items=1 for one row per order item
+    and format (csv, ndjson or parquet)."""
+    fmt = request.args.get('format', 'csv')
+    format_error = export_format_error(fmt)
+    if format_error:
+        return jsonify({'error': format_error}), 400
+    try:
+        start_day = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+        end_day = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    seller_id = request.args.get('seller_id', '').strip() or None
+    if seller_id is not None:
+        if not seller_id.isdigit():
+            return jsonify({'error': 'seller_id must be a user id'}), 400
+        seller_id = int(seller_id)
+
+    include_items = request.args.get('items') == '1'
+    available = dict(ORDER_EXPORT_COLUMNS, **(ORDER_ITEM_EXPORT_COLUMNS if include_items else {}))
+    columns = [c.strip() for c in request.args.get('columns', '').split(',') if c.strip()]
+    if not columns:
+        columns = DEFAULT_ORDER_EXPORT_COLUMNS + (list(ORDER_ITEM_EXPORT_COLUMNS) if include_items else [])
+    unknown = [c for c in columns if c not in available]
+    if unknown:
+        return jsonify({'error': f"Unknown columns: {', '.join(unknown)}"}), 400
+
+    query = db.select(*[available[c].label(c) for c in columns]).select_from(Order)
+    if include_items:
+        item_join = OrderItem.order_id == Order.id
+        if seller_id is not None:
+            item_join = db.and_(item_join, OrderItem.seller_id == seller_id)
+        query = query.join(OrderItem, item_join)
+    elif seller_id is not None:
+        query = query.where(db.exists().where(OrderItem.order_id == Order.id, OrderItem.seller_id == seller_id))
+    if start_day or end_day:
+        query = query.where(created_between(Order.created_at, start_day, end_day))
+    statuses = [s.strip() for s in request.args.get('status', '').split(',') if s.strip()]
+    if statuses:
+        query = query.where(Order.status.in_(statuses))
+    query = query.order_by(Order.created_at.desc(), Order.id.desc())
+    if include_items:
+        query = query.order_by(OrderItem.id)
+
+    return export_response('orders_items_report' if include_items else 'orders_report', query, fmt)
+
+@app.route('/admin/export/<table>')
+@roles_required('admin')
+def admin_export_table(table):
+    """Exports all rows of an export table. ?since_id=N limits it to rows with a higher id;
+    ?watermark=<consumer> starts from that consumer's stored watermark and advances it once the export completes.
+    The X-Export-Watermark header carries the highest id covered by the export.
+
+    Incremental pulls are append-only: a row is sent once, when it is new, and never again
+    when it is later updated (order status, item is_paid_to_seller). Status changes arrive as
+    new order_status_history rows and payouts as new payouts rows; consumers that mirror the
+    mutable columns of orders or order_items must re-pull those tables in full."""
+    model = EXPORT_TABLES.get(table)
+    if model is None:
+        return jsonify({'error': f"Unknown table. Use one of: {', '.join(EXPORT_TABLES)}"}), 404
+    fmt = request.args.get('format', 'parquet' if pyarrow_module.get() is not None else 'ndjson')
+    format_error = export_format_error(fmt)
+    if format_error:
+        return jsonify({'error': format_error}), 400
+
+    consumer = request.args.get('watermark')
+    since_id = request.args.get('since_id', type=int)
+    if consumer:
+        watermark = db.session.get(ExportWatermark, f'{consumer}:{table}')
+        since_id = watermark.last_id if watermark else 0
+
+    # Fix the upper bound up front so rows inserted mid-export are left for the next pull
+    upper_id = db.session.scalar(db.select(db.func.max(model.id))) or 0
+    query = db.select(*model.__table__.columns).where(model.id <= upper_id)
+    if since_id:
+        query = query.where(model.id > since_id)
+    query = query.order_by(model.id)
+
+    def on_complete():
+        advance_export_watermark(f'{consumer}:{table}', upper_id)
+    return export_response(table, query, fmt, on_complete if consumer else None,
+                           headers={'X-Export-Watermark': str(upper_id)})
 
 @app.route('/admin/track_order/<int:order_id>')
 @roles_required('admin')
@@ -2132,9 +3994,9 @@ def admin_low_stock():
         if threshold is not None:
             threshold = int(threshold)
         else:
-            threshold = 5
+            threshold = LOW_STOCK_THRESHOLD
     except ValueError:
-        threshold = 5
+        threshold = LOW_STOCK_THRESHOLD
     products = Product.query.filter(Product.quantity <= threshold).order_by(Product.quantity.asc()).all()
     data = [{'id': p.id, 'name': p.name, 'quantity': p.quantity, 'unit': p.unit} for p in products]
     return {'products': data, 'threshold': threshold, 'count': len(data)}, 200
@@ -2187,47 +4049,75 @@ def admin_edit_user(user_id):
 
 @app.route('/admin/payouts')
 @roles_required('admin')
+@read_replica
 def admin_payouts():
     """View for managing seller payouts."""
-    # Get all sellers
-    sellers = User.query.filter(User.role.in_(['seller', 'farmer'])).all()
-    payout_data = []
-    
-    for seller in sellers:
-        # Calculate pending balance: Sum of items sold that are Delivered/Completed but not paid out
-        pending_items_query = db.session.query(
-            db.func.sum(OrderItem.price * OrderItem.quantity).label('gross_total'),
-            db.func.sum(OrderItem.commission_amount).label('total_commission')
-        ).join(Order, OrderItem.order_id == Order.id)\
-         .filter(
-             OrderItem.seller_id == seller.id,
-             OrderItem.is_paid_to_seller == False,
-             Order.status.in_(['Delivered', 'Completed'])
-         ).first()
-        
-        gross_amount = pending_items_query.gross_total or 0
-        total_commission = pending_items_query.total_commission or 0
-        pending_amount = gross_amount - total_commission
-         
-        last_payout = Payout.query.filter_by(seller_id=seller.id).order_by(Payout.created_at.desc()).first()
-        
-        payout_data.append({
+    page = request.args.get('page', 1, type=int)
+    per_page = 20
+    sort_by = request.args.get('sort', 'pending')
+
+    # Pending balance per seller: items Delivered/Completed but not yet paid out
+    pending = db.session.query(
+        OrderItem.seller_id.label('seller_id'),
+        db.func.sum(OrderItem.price * OrderItem.quantity).label('gross_total'),
+        db.func.sum(OrderItem.commission_amount).label('total_commission')
+    ).join(Order, OrderItem.order_id == Order.id)\
+     .filter(
+         OrderItem.is_paid_to_seller == False,
+         Order.status.in_(['Delivered', 'Completed'])
+     ).group_by(OrderItem.seller_id).subquery()
+
+    # Latest payout per seller
+    ranked_payouts = db.session.query(
+        Payout.seller_id.label('seller_id'),
+        Payout.amount.label('amount'),
+        Payout.created_at.label('created_at'),
+        db.func.row_number().over(
+            partition_by=Payout.seller_id,
+            order_by=(Payout.created_at.desc(), Payout.id.desc())
+        ).label('rn')
+    ).subquery()
+    last_payout = db.session.query(ranked_payouts).filter(ranked_payouts.c.rn == 1).subquery()
+
+    gross_amount = db.func.coalesce(pending.c.gross_total, 0)
+    total_commission = db.func.coalesce(pending.c.total_commission, 0)
+    pending_amount = gross_amount - total_commission
+
+    sellers_query = db.session.query(
+        User,
+        gross_amount.label('gross_amount'),
+        total_commission.label('total_commission'),
+        pending_amount.label('pending_amount'),
+        last_payout.c.created_at.label('last_payout_date'),
+        last_payout.c.amount.label('last_payout_amount')
+    ).outerjoin(pending, pending.c.seller_id == User.id)\
+     .outerjoin(last_payout, last_payout.c.seller_id == User.id)\
+     .filter(User.role.in_(['seller', 'farmer']))
+
+    if sort_by == 'name':
+        sellers_query = sellers_query.order_by(User.name.asc(), User.id.asc())
+    else:
+        sort_by = 'pending'
+        sellers_query = sellers_query.order_by(pending_amount.desc(), User.id.asc())
+
+    sellers_pagination = sellers_query.paginate(page=page, per_page=per_page, error_out=False)
+    payout_data = [
+        {
             'seller': seller,
-            'pending_amount': pending_amount,
-            'gross_amount': gross_amount,
-            'total_commission': total_commission,
-            'last_payout_date': last_payout.created_at if last_payout else None,
-            'last_payout_amount': last_payout.amount if last_payout else 0
-        })
+            'pending_amount': pending_value,
+            'gross_amount': gross_value,
+            'total_commission': commission_value,
+            'last_payout_date': last_date,
+            'last_payout_amount': last_amount or 0
+        }
+        for seller, gross_value, commission_value, pending_value, last_date, last_amount in sellers_pagination.items
+    ]
     
     # Payout History
     payout_history = db.session.query(Payout, User.name).join(User, Payout.seller_id == User.id).order_by(Payout.created_at.desc()).all()
     
-    # Add context for the layout
-    pending_orders_count = Order.query.filter_by(status='Pending').count()
-    low_stock_count = Product.query.filter(Product.quantity <= 5).count()
-
-    return render_template('admin_payouts.html', payout_data=payout_data, payout_history=payout_history, active_page='payouts', pending_orders_count=pending_orders_count, low_stock_count=low_stock_count)
+    return render_template('admin_payouts.html', payout_data=payout_data, payout_history=payout_history, active_page='payouts',
+                           sellers_pagination=sellers_pagination, sort_by=sort_by, **get_admin_header_stats())
 
 @app.route('/admin/process_payout', methods=['POST'])
 @roles_required('admin')
@@ -2265,9 +4155,10 @@ def admin_process_payout():
     if seller:
         msg = f"Payout of Rs.{net_amount:.2f} processed. Ref: {transaction_ref}."
         if seller.phone:
-            send_sms(seller.phone, msg)
+            queue_sms(seller.phone, msg, commit=False)
         if seller.email:
-            send_notification_email(seller.email, "Payout Processed", f"Dear {seller.name},\n\n{msg}\n\nThank you.")
+            queue_email(seller.email, "Payout Processed", f"Dear {seller.name},\n\n{msg}\n\nThank you.", commit=False)
+        db.session.commit()
 
     flash(f'Payout of ₹{net_amount:.2f} recorded successfully.', 'success')
     return redirect(url_for('admin_payouts'))
@@ -2381,6 +4272,9 @@ def product_detail(product_id):
             review_text=review_text
         )
         db.session.add(new_review)
+        # Update the denormalized aggregates in the same transaction
+        product.avg_rating = (Product.avg_rating * Product.review_count + new_review.rating) / (Product.review_count + 1)
+        product.review_count = Product.review_count + 1
         db.session.commit()
 
         flash('Thank you for your review!', 'success')
@@ -2388,8 +4282,8 @@ def product_detail(product_id):
 
     # GET request logic
     reviews_with_users = db.session.query(ProductReview, User.name).join(User, ProductReview.buyer_id == User.id).filter(ProductReview.product_id == product_id).order_by(ProductReview.created_at.desc()).all()
-    avg_rating = db.session.query(db.func.avg(ProductReview.rating)).filter(ProductReview.product_id == product_id).scalar() or 0
-    review_count = ProductReview.query.filter_by(product_id=product_id).count()
+    avg_rating = product.avg_rating or 0
+    review_count = product.review_count or 0
     
     can_review = False
     if 'user_id' in session and session['user_role'] == 'buyer':
@@ -2400,6 +4294,34 @@ def product_detail(product_id):
 
     return render_template('product_detail.html', product=product, reviews_with_users=reviews_with_users, avg_rating=avg_rating, review_count=review_count, can_review=can_review)
 
+def get_seller_sales_stats(seller_id, series_start):
+    """Computes a seller's lifetime KPIs, pending payout and daily sales since
+    `series_start` with a single GROUP BY over their order items."""
+    gross = OrderItem.price * OrderItem.quantity
+    is_pending = db.and_(OrderItem.is_paid_to_seller == False, Order.status.in_(['Delivered', 'Completed']))
+    # Rows before the series start fall into one NULL bucket that only feeds the lifetime totals
+    day_key = db.case((Order.created_at >= day_start(series_start), db.func.date(Order.created_at)), else_=None)
+
+    rows = db.session.query(
+        day_key,
+        db.func.sum(gross),
+        db.func.sum(OrderItem.quantity),
+        db.func.sum(db.case((is_pending, gross), else_=0)),
+        db.func.sum(db.case((is_pending, OrderItem.commission_amount), else_=0))
+    ).join(Order, OrderItem.order_id == Order.id)\
+     .filter(OrderItem.seller_id == seller_id)\
+     .group_by(day_key).all()
+
+    stats = {'total_earnings': 0, 'total_sold': 0, 'pending_gross': 0, 'pending_commission': 0, 'daily_sales': {}}
+    for day, sales, sold, pending_gross, pending_commission in rows:
+        stats['total_earnings'] += sales or 0
+        stats['total_sold'] += sold or 0
+        stats['pending_gross'] += pending_gross or 0
+        stats['pending_commission'] += pending_commission or 0
+        if day is not None:
+            stats['daily_sales'][_as_date(day)] = sales or 0
+    return stats
+
 @app.route('/seller_dashboard')
 @roles_required('seller', 'farmer')
 def seller_dashboard():
@@ -2408,44 +4330,20 @@ def seller_dashboard():
     # --- Products ---
     products = Product.query.filter_by(seller_id=user_id).order_by(Product.created_at.desc()).all()
     
-    # --- Sales Stats ---
-    # Total lifetime earnings (gross)
-    total_earnings = db.session.query(db.func.sum(OrderItem.price * OrderItem.quantity))\
-        .filter(OrderItem.seller_id == user_id).scalar() or 0
-    
-    # Total items sold
-    total_sold = db.session.query(db.func.sum(OrderItem.quantity))\
-        .filter(OrderItem.seller_id == user_id).scalar() or 0
+    # --- Sales Stats, pending payout and chart series in one grouped pass ---
+    range_days = request.args.get('days', 7, type=int)
+    if range_days not in SELLER_DASHBOARD_RANGES:
+        range_days = SELLER_DASHBOARD_RANGES[0]
+    today = datetime.now().date()
+    starts = last_buckets('day', range_days, today)
 
-    # --- Pending Payout ---
-    pending_items_query = db.session.query(
-        db.func.sum(OrderItem.price * OrderItem.quantity).label('gross_total'),
-        db.func.sum(OrderItem.commission_amount).label('total_commission')
-    ).join(Order, OrderItem.order_id == Order.id)\
-     .filter(
-         OrderItem.seller_id == user_id,
-         OrderItem.is_paid_to_seller == False,
-         Order.status.in_(['Delivered', 'Completed'])
-     ).first()
-    
-    gross_pending = pending_items_query.gross_total or 0
-    commission_pending = pending_items_query.total_commission or 0
-    pending_amount = gross_pending - commission_pending
+    stats = get_seller_sales_stats(user_id, starts[0])
+    total_earnings = stats['total_earnings']
+    total_sold = stats['total_sold']
+    pending_amount = stats['pending_gross'] - stats['pending_commission']
 
-    # --- Chart Data (last 7 days) ---
-    today = datetime.now().date()
-    sales_labels = []
-    sales_values = []
-    
-    for i in range(7):
-        day = today - timedelta(days=i)
-        day_sales = db.session.query(db.func.sum(OrderItem.price * OrderItem.quantity))\
-         .join(Order, OrderItem.order_id == Order.id)\
-         .filter(OrderItem.seller_id == user_id)\
-         .filter(db.func.date(Order.created_at) == day).scalar() or 0
-        
-        sales_labels.insert(0, day.strftime('%b %d'))
-        sales_values.insert(0, day_sales)
+    sales_labels = [day.strftime('%b %d') for day in starts]
+    sales_values = [stats['daily_sales'].get(day, 0) for day in starts]
 
     return render_template('seller_dashboard.html', 
                            active_page='dashboard',
@@ -2454,7 +4352,9 @@ def seller_dashboard():
                            total_sold=total_sold,
                            pending_amount=pending_amount,
                            sales_labels=sales_labels,
-                           sales_values=sales_values)
+                           sales_values=sales_values,
+                           range_days=range_days,
+                           range_options=SELLER_DASHBOARD_RANGES)
 
 @app.route('/seller/payouts')
 @roles_required('seller', 'farmer')
@@ -2534,5 +4434,148 @@ def payout_invoice(payout_id):
     seller = db.session.get(User, payout.seller_id)
     return render_template('payout_invoice.html', payout=payout, seller=seller)
 
+@app.cli.command('run-notification-worker')
+@click.option('--once', is_flag=True, help='Drain the outbox once and exit.')
+@click.option('--poll', default=5.0, show_default=True, help='Seconds between outbox polls.')
+def run_notification_worker_command(once, poll):
+    """Delivers queued SMS and email notifications and runs queued promotion campaigns."""
+    while True:
+        sent = 0
+        while True:
+            batch = dispatch_outbox()
+            sent += batch
+            if not batch:
+                break
+        if once:
+            print(f"Dispatched {sent} notifications.")
+            return
+        resume_promotion_campaigns()
+        time.sleep(poll)
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Applies pending database migrations."""
+    before = read_schema_state()
+    applied = run_migrations()
+    for name in applied:
+        print(f"Applied {name}")
+    print(f"Schema version {before} -> {read_schema_state()} (latest {LATEST_SCHEMA_VERSION}).")
+
+@app.cli.command('run-promotions')
+@click.option('--campaign-id', type=int, default=None, help='Run or resume one campaign.')
+def run_promotions_command(campaign_id):
+    """Sends queued promotion campaigns, or resumes an interrupted one."""
+    if campaign_id is not None:
+        ids = [campaign_id]
+    else:
+        requeue_stale_campaigns()
+        db.session.commit()
+        ids = db.session.scalars(db.select(PromotionCampaign.id)
+                                 .where(PromotionCampaign.status == 'queued').order_by(PromotionCampaign.id)).all()
+    for cid in ids:
+        campaign = run_promotion_campaign(cid)
+        if campaign is None:
+            print(f"Campaign {cid} not found.")
+            continue
+        progress = campaign_progress(campaign)
+        print(f"Campaign {cid}: {progress['status']}, {progress['sent']} sent, {progress['failed']} failed, "
+              f"{progress['messages_per_second']} msgs/sec")
+
+@app.cli.command('release-expired-holds')
+def release_expired_holds_command():
+    """Returns stock from expired checkout holds to the catalog."""
+    count = release_expired_holds()
+    db.session.commit()
+    print(f"Released {count} expired stock holds.")
+
+@app.cli.command('rebuild-sales-rollup')
+def rebuild_sales_rollup_command():
+    """Recomputes the daily sales rollup from the order tables."""
+    count = rebuild_daily_sales_rollup()
+    db.session.commit()
+    print(f"Rebuilt {count} daily sales rollup rows.")
+
+def _index_audit_queries():
+    """The hot query shapes used by the app, as (label, statement) pairs."""
+    today = datetime.utcnow().date()
+    week_ago = today - timedelta(days=7)
+    return [
+        ('cart by buyer', db.select(Cart).where(Cart.buyer_id == 1)),
+        ('cart line lookup', db.select(Cart).where(Cart.buyer_id == 1, Cart.product_id == 1)),
+        ('cart count', db.select(db.func.sum(Cart.quantity)).where(Cart.buyer_id == 1)),
+        ('buyer order history', db.select(Order).where(Order.buyer_id == 1).order_by(Order.created_at.desc())),
+        ('pending orders', db.select(db.func.count(Order.id)).where(Order.status == 'Pending')),
+        ('orders by date range', db.select(db.func.sum(Order.total_amount)).where(created_between(Order.created_at, week_ago, today))),
+        ('orders by delivery person', db.select(Order).where(Order.delivery_person_id == 1).order_by(Order.created_at.desc())),
+        ('items of an order', db.select(OrderItem).where(OrderItem.order_id == 1)),
+        ('seller sales', db.select(db.func.sum(OrderItem.price * OrderItem.quantity)).where(OrderItem.seller_id == 1)),
+        ('seller pending payout', db.select(db.func.sum(OrderItem.commission_amount))
+            .join(Order, OrderItem.order_id == Order.id)
+            .where(OrderItem.seller_id == 1, OrderItem.is_paid_to_seller == False, Order.status.in_(['Delivered', 'Completed']))),
+        ('purchase check', db.select(Order.id).join(OrderItem)
+            .where(Order.buyer_id == 1, OrderItem.product_id == 1, Order.status.in_(['Completed', 'Delivered']))),
+        ('catalog by category', db.select(Product).where(db.func.lower(Product.category) == 'fruits').order_by(Product.created_at.desc()).limit(12)),
+        ('catalog category group', db.select(Product).where(Product.category.in_(PRODUCE_CATEGORIES))),
+        ('catalog newest', db.select(Product).order_by(Product.created_at.desc()).limit(12)),
+        ('catalog popular', db.select(Product).order_by(Product.review_count.desc()).limit(12)),
+        ('catalog by price, deep page', db.select(Product).where(db.tuple_(Product.price, Product.id) > db.tuple_(100.0, 1))
+            .order_by(Product.price.asc(), Product.id.asc()).limit(13)),
+        ('admin orders, deep page', db.select(Order).where(db.tuple_(Order.created_at, Order.id) < db.tuple_(datetime.utcnow(), 1))
+            .order_by(Order.created_at.desc(), Order.id.desc()).limit(16)),
+        ('admin users, deep page', db.select(User).where(db.tuple_(User.created_at, User.id) < db.tuple_(datetime.utcnow(), 1))
+            .order_by(User.created_at.desc(), User.id.desc()).limit(16)),
+        ('seller products', db.select(Product).where(Product.seller_id == 1).order_by(Product.created_at.desc())),
+        ('order status history', db.select(OrderStatusHistory).where(OrderStatusHistory.order_id == 1).order_by(OrderStatusHistory.timestamp.asc())),
+        ('order notes', db.select(OrderNote).where(OrderNote.order_id == 1).order_by(OrderNote.created_at.asc())),
+        ('product reviews', db.select(ProductReview).where(ProductReview.product_id == 1).order_by(ProductReview.created_at.desc())),
+        ('existing review check', db.select(ProductReview).where(ProductReview.buyer_id == 1, ProductReview.product_id == 1)),
+        ('seller payouts', db.select(Payout).where(Payout.seller_id == 1).order_by(Payout.created_at.desc())),
+        ('expired stock holds', db.select(StockHold).where(StockHold.expires_at < datetime.utcnow())),
+        ('buyer stock holds', db.select(StockHold).where(StockHold.buyer_id == 1)),
+        ('daily sales rollup', db.select(DailySalesRollup).where(DailySalesRollup.day >= week_ago, DailySalesRollup.day <= today)),
+    ]
+
+@app.cli.command('audit-indexes')
+def audit_indexes_command():
+    """Runs EXPLAIN QUERY PLAN over the app's hot queries and flags full table scans."""
+    if db.engine.dialect.name != 'sqlite':
+        print(f"Index audit only supports SQLite (current database: {db.engine.dialect.name}).")
+        return
+
+    problems = 0
+    with db.engine.connect() as connection:
+        for label, statement in _index_audit_queries():
+            sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+            plan = [row[3] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+            # "SCAN <table>" without an index is a full table scan
+            full_scans = [step for step in plan if step.startswith('SCAN ') and ' USING ' not in step]
+            status = 'FULL SCAN' if full_scans else 'ok'
+            print(f"[{status:>9}] {label}: {'; '.join(plan)}")
+            problems += len(full_scans)
+
+    if problems:
+        print(f"\n{problems} full table scan(s) found.")
+        raise SystemExit(1)
+    print("\nAll audited queries use an index.")
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Re-creates the product full-text search index."""
+    if not _search_index['available']:
+        print("Full-text search (FTS5) is not available on this database.")
+        return
+    count = rebuild_product_search_index()
+    db.session.commit()
+    print(f"Indexed {count} products.")
+
+@app.cli.command('repair-product-ratings')
+def repair_product_ratings_command():
+    """Recomputes every product's avg_rating and review_count from its reviews."""
+    count = recompute_product_ratings()
+    db.session.commit()
+    print(f"Recomputed ratings for {count} products.")
+
 if __name__ == '__main__':
+    with app.app_context():
+        run_migrations()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""Checkout benchmark: SQL statements per order and checkout latency by cart size.
+
+Runs COD checkouts through the Flask test client against a throwaway SQLite
+database and reports statements per order and p50/p95 latency for 1, 10 and
+50-line carts.
+
+Usage:
+    python benchmarks/checkout_bench.py [--runs 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+DB_DIR = tempfile.mkdtemp(prefix='emanddi-bench-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DB_DIR, 'bench.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import app as emanddi  # noqa: E402
+
+CART_SIZES = (1, 10, 50)
+
+
+def seed(max_lines):
+    db = emanddi.db
+    seller = emanddi.User(name='Bench Seller', email='seller@bench', password='x', role='seller')
+    buyer = emanddi.User(name='Bench Buyer', email='buyer@bench', password=generate_password_hash('bench'), role='buyer')
+    db.session.add_all([seller, buyer])
+    db.session.flush()
+    categories = emanddi.PRODUCE_CATEGORIES + emanddi.SUPPLIES_CATEGORIES
+    products = [
+        emanddi.Product(name=f'Item {i}', category=categories[i % len(categories)], price=10 + i,
+                        quantity=10 ** 9, seller_id=seller.id)
+        for i in range(max_lines)
+    ]
+    db.session.add_all(products)
+    db.session.commit()
+    return buyer.id, [p.id for p in products]
+
+
+def fill_cart(buyer_id, product_ids):
+    db = emanddi.db
+    db.session.execute(db.insert(emanddi.Cart), [
+        {'buyer_id': buyer_id, 'product_id': pid, 'quantity': 2} for pid in product_ids
+    ])
+    db.session.commit()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=50, help='checkouts per cart size')
+    args = parser.parse_args()
+
+    app = emanddi.app
+    statements = {'count': 0}
+
+    with app.app_context():
+        emanddi.run_migrations()
+        engine = emanddi.db.engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements['count'] += 1
+
+        buyer_id, product_ids = seed(max(CART_SIZES))
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'buyer@bench', 'password': 'bench'})
+
+    print(f"{'lines':>5} {'stmts/order':>12} {'p50 ms':>8} {'p95 ms':>8}")
+    for size in CART_SIZES:
+        latencies, counts = [], []
+        for _ in range(args.runs):
+            with app.app_context():
+                fill_cart(buyer_id, product_ids[:size])
+            statements['count'] = 0
+            started = time.perf_counter()
+            response = client.post('/checkout', data={'payment_mode': 'COD', 'shipping_address': 'Bench', 'distance': '10'})
+            latencies.append((time.perf_counter() - started) * 1000)
+            counts.append(statements['count'])
+            assert response.status_code == 302, response.status_code
+        print(f"{size:>5} {statistics.median(counts):>12.0f} {percentile(latencies, 50):>8.2f} {percentile(latencies, 95):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Concurrency benchmark: read/write throughput with 1-16 worker processes on SQLite.
+
+Starts N processes that each import app.py, the way gunicorn workers do, against
+a shared throwaway SQLite database and runs a mix of catalog reads and stock
+decrements for a fixed time. Reports reads/s, writes/s and "database is locked"
+failures per worker count, with the connection tuning on (WAL, busy_timeout, ...)
+and, with --compare, off (SQLITE_TUNING=0, rollback journal) on a fresh database.
+
+Usage:
+    python benchmarks/concurrency_bench.py [--seconds 5] [--write-ratio 0.2] [--workers 1,2,4,8,16] [--compare]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRODUCTS = 500
+
+
+def prepare(db_path, tuning):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['SQLITE_TUNING'] = '1' if tuning else '0'
+    sys.path.insert(0, APP_DIR)
+    import app as emanddi
+    return emanddi
+
+
+def seed(db_path, tuning):
+    emanddi = prepare(db_path, tuning)
+    db = emanddi.db
+    with emanddi.app.app_context():
+        emanddi.run_migrations()
+        seller = emanddi.User(name='Bench Seller', email='seller@bench', password='x', role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        categories = emanddi.PRODUCE_CATEGORIES + emanddi.SUPPLIES_CATEGORIES
+        db.session.execute(db.insert(emanddi.Product), [
+            {'name': f'Item {i}', 'category': categories[i % len(categories)], 'price': 10 + i,
+             'quantity': 10 ** 9, 'seller_id': seller.id}
+            for i in range(PRODUCTS)
+        ])
+        db.session.commit()
+
+
+def worker(db_path, tuning, seconds, write_ratio, start, results):
+    emanddi = prepare(db_path, tuning)
+    db, Product = emanddi.db, emanddi.Product
+    categories = emanddi.PRODUCE_CATEGORIES + emanddi.SUPPLIES_CATEGORIES
+    reads = writes = locked = 0
+    rng = random.Random(os.getpid())
+    with emanddi.app.app_context():
+        db.session.execute(db.select(Product.id).limit(1)).all()  # open the pooled connection before timing
+        start.wait()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            try:
+                if rng.random() < write_ratio:
+                    emanddi.reserve_stock({rng.randint(1, PRODUCTS): 1})
+                    db.session.commit()
+                    writes += 1
+                else:
+                    Product.query.filter(Product.category == rng.choice(categories))\
+                        .order_by(Product.created_at.desc()).limit(20).all()
+                    db.session.rollback()
+                    reads += 1
+            except emanddi.OperationalError as error:
+                db.session.rollback()
+                if 'database is locked' not in str(error.orig):
+                    raise
+                locked += 1
+    results.put((reads, writes, locked))
+
+
+def run(db_path, tuning, workers, seconds, write_ratio):
+    ctx = multiprocessing.get_context('spawn')
+    start, results = ctx.Barrier(workers + 1), ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(db_path, tuning, seconds, write_ratio, start, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    start.wait()
+    totals = [sum(column) for column in zip(*(results.get() for _ in processes))]
+    for process in processes:
+        process.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--workers', default='1,2,4,8,16')
+    parser.add_argument('--compare', action='store_true', help='also run with SQLite tuning disabled')
+    args = parser.parse_args()
+    worker_counts = [int(n) for n in args.workers.split(',')]
+
+    modes = [True, False] if args.compare else [True]
+    print(f"{'tuning':<7} {'workers':>7} {'reads/s':>10} {'writes/s':>10} {'locked':>7}")
+    for tuning in modes:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='emanddi-bench-'), 'bench.db')
+        seed_process = multiprocessing.get_context('spawn').Process(target=seed, args=(db_path, tuning))
+        seed_process.start()
+        seed_process.join()
+        for workers in worker_counts:
+            reads, writes, locked = run(db_path, tuning, workers, args.seconds, args.write_ratio)
+            print(f"{'on' if tuning else 'off':<7} {workers:>7} {reads / args.seconds:>10.0f} "
+                  f"{writes / args.seconds:>10.0f} {locked:>7}")
+
+
+if __name__ == '__main__':
+    main()
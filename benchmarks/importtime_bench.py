@@ -0,0 +1,74 @@
+"""Import-time benchmark: where a worker's `import app` time goes.
+
+Runs `python -X importtime -c "import app"` against a migrated throwaway SQLite
+database and reports the cumulative import time of app.py, the heaviest
+top-level packages, and whether each third-party integration was imported at
+startup.
+
+Usage:
+    python benchmarks/importtime_bench.py [--runs 5] [--top 12] [--app-dir PATH]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+INTEGRATIONS = ('razorpay', 'twilio', 'qrcode', 'smtplib', 'email.mime', 'numpy', 'pyarrow')
+IMPORT_SNIPPET = "import sys, app; print('\\n'.join(sys.modules))"
+
+
+def importtime(app_dir, env):
+    """Imports app in a fresh interpreter. Returns ({module: cumulative microseconds}, loaded module names)."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_SNIPPET], cwd=app_dir, env=env,
+                            capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nesting is shown by indentation; the top-level import of a package carries its whole subtree
+        modules.setdefault(name.strip(), int(cumulative))
+    # -X importtime also lists failed imports, so check what actually ended up loaded
+    return modules, set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=12)
+    parser.add_argument('--app-dir', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help='checkout of the app to measure (default: this one)')
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='emanddi-bench-')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(db_dir, 'bench.db'))
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=args.app_dir, env=env,
+                   capture_output=True)
+
+    results = [importtime(args.app_dir, env) for _ in range(args.runs)]
+    runs = [modules for modules, _ in results]
+    loaded = results[0][1]
+    app_ms = statistics.median(run['app'] for run in runs) / 1000
+    print(f"import app: p50 {app_ms:.1f} ms over {args.runs} runs\n")
+
+    packages = defaultdict(list)
+    for run in runs:
+        for name, cumulative in run.items():
+            if '.' not in name and name != 'app':
+                packages[name].append(cumulative)
+    heaviest = sorted(packages.items(), key=lambda item: -statistics.median(item[1]))[:args.top]
+    print(f"{'package':<24} {'p50 ms':>8}")
+    for name, timings in heaviest:
+        print(f"{name:<24} {statistics.median(timings) / 1000:>8.1f}")
+
+    print(f"\n{'integration':<24} {'at startup':>10}")
+    for name in INTEGRATIONS:
+        imported = any(module == name or module.startswith(name + '.') for module in loaded)
+        print(f"{name:<24} {'yes' if imported else 'no':>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""SMTP benchmark: messages/sec with a connection per message vs the pooled sender.
+
+Starts a local debugging SMTP server that accepts and discards mail, then
+sends the same messages three ways: a fresh connection per message (the old
+send path), send_notification_email through the pool, and one batched
+send_notification_emails call. --handshake-ms adds a delay to each new
+connection's greeting to approximate the TLS and AUTH round trips of a real
+provider.
+
+Usage:
+    python benchmarks/smtp_bench.py [--messages 200] [--handshake-ms 50]
+"""
+import argparse
+import os
+import smtplib
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+DB_DIR = tempfile.mkdtemp(prefix='emanddi-bench-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DB_DIR, 'bench.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as emanddi  # noqa: E402
+
+SENDER = 'bench@localhost'
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server: speaks enough of RFC 5321 for smtplib and discards the mail."""
+    handshake_seconds = 0.0
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        time.sleep(self.handshake_seconds)
+        self.reply('220 localhost debugging SMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command.startswith('DATA'):
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.received += 1
+                self.reply('250 OK')
+            elif command.startswith('QUIT'):
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    received = 0
+
+
+def send_unpooled(port, messages):
+    """The pre-pool send path: connect, send and quit for every message."""
+    for recipient, subject, body in messages:
+        server = smtplib.SMTP('127.0.0.1', port)
+        server.sendmail(SENDER, recipient, emanddi.build_email(SENDER, recipient, subject, body))
+        server.quit()
+
+
+def send_pooled(port, messages):
+    for recipient, subject, body in messages:
+        assert emanddi.send_notification_email(recipient, subject, body)
+
+
+def send_batched(port, messages):
+    assert all(delivered for delivered, _ in emanddi.send_notification_emails(messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--handshake-ms', type=float, default=0.0,
+                        help='delay added to each new connection')
+    args = parser.parse_args()
+
+    with emanddi.app.app_context():
+        emanddi.run_migrations()
+
+    DebuggingSMTPHandler.handshake_seconds = args.handshake_ms / 1000.0
+    server = DebuggingSMTPServer(('127.0.0.1', 0), DebuggingSMTPHandler)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ.update({'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(port), 'MAIL_USERNAME': SENDER,
+                       'MAIL_USE_TLS': '0', 'MAIL_USE_AUTH': '0'})
+    messages = [(f'user{i}@example.com', 'Payout processed', f'Payout #{i} has been processed.')
+                for i in range(args.messages)]
+
+    print(f"{'mode':>10} {'msgs/sec':>10} {'delivered':>10}")
+    for name, sender in (('unpooled', send_unpooled), ('pooled', send_pooled), ('batched', send_batched)):
+        emanddi.get_smtp_pool().close_all()
+        server.received = 0
+        started = time.perf_counter()
+        sender(port, messages)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>10} {len(messages) / elapsed:>10.0f} {server.received:>10}")
+
+    emanddi.get_smtp_pool().close_all()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Startup benchmark: how long a fresh worker takes to import the app.
+
+Prepares a throwaway SQLite database with one untimed import (and `flask migrate`
+where the app supports it), then imports app.py in new interpreter processes,
+the way each gunicorn worker does, and reports p50/max import time.
+
+Usage:
+    python benchmarks/startup_bench.py [--runs 20] [--app-dir PATH]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started)
+"""
+
+
+def run_import(app_dir, env):
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=app_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--app-dir', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help='checkout of the app to measure (default: this one)')
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='emanddi-bench-')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(db_dir, 'bench.db'))
+    # Older checkouts migrate on import and have no `flask migrate`; either way the database ends up current
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=args.app_dir, env=env,
+                   capture_output=True)
+    run_import(args.app_dir, env)
+
+    timings = [run_import(args.app_dir, env) * 1000 for _ in range(args.runs)]
+    print(f"{'runs':>5} {'p50 ms':>8} {'max ms':>8}")
+    print(f"{args.runs:>5} {statistics.median(timings):>8.1f} {max(timings):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
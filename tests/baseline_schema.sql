@@ -0,0 +1,151 @@
+-- Schema created by app.py before versioned migrations (baseline commit), used to test upgrades.
+
+CREATE TABLE user (
+	id INTEGER NOT NULL,
+	name VARCHAR(100) NOT NULL,
+	email VARCHAR(100) NOT NULL,
+	password VARCHAR(200) NOT NULL,
+	role VARCHAR(20) NOT NULL,
+	phone VARCHAR(20),
+	account_number VARCHAR(50),
+	upi_phone_number VARCHAR(20),
+	created_at DATETIME,
+	is_approved BOOLEAN,
+	PRIMARY KEY (id),
+	UNIQUE (email)
+);
+
+CREATE TABLE delivery_person (
+	id INTEGER NOT NULL,
+	name VARCHAR(100) NOT NULL,
+	phone VARCHAR(20) NOT NULL,
+	address TEXT,
+	vehicle_type VARCHAR(50),
+	vehicle_number VARCHAR(20) NOT NULL,
+	license_number VARCHAR(30) NOT NULL,
+	is_active BOOLEAN NOT NULL,
+	created_at DATETIME,
+	profile_picture VARCHAR(200),
+	license_image VARCHAR(200),
+	PRIMARY KEY (id),
+	UNIQUE (phone),
+	UNIQUE (vehicle_number),
+	UNIQUE (license_number)
+);
+
+CREATE TABLE site_setting (
+	"key" VARCHAR(50) NOT NULL,
+	value VARCHAR(200) NOT NULL,
+	PRIMARY KEY ("key")
+);
+
+CREATE TABLE product (
+	id INTEGER NOT NULL,
+	name VARCHAR(100) NOT NULL,
+	category VARCHAR(50) NOT NULL,
+	price FLOAT NOT NULL,
+	quantity INTEGER NOT NULL,
+	unit VARCHAR(20) NOT NULL,
+	image VARCHAR(200),
+	seller_id INTEGER NOT NULL,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(seller_id) REFERENCES user (id) ON DELETE CASCADE
+);
+
+CREATE TABLE "order" (
+	id INTEGER NOT NULL,
+	buyer_id INTEGER NOT NULL,
+	total_amount FLOAT NOT NULL,
+	payment_mode VARCHAR(50) NOT NULL,
+	shipping_address TEXT,
+	status VARCHAR(20),
+	delivery_fee FLOAT,
+	delivery_cost FLOAT,
+	created_at DATETIME,
+	delivery_person_id INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(buyer_id) REFERENCES user (id) ON DELETE CASCADE,
+	FOREIGN KEY(delivery_person_id) REFERENCES delivery_person (id)
+);
+
+CREATE TABLE payout (
+	id INTEGER NOT NULL,
+	seller_id INTEGER NOT NULL,
+	amount FLOAT NOT NULL,
+	transaction_ref VARCHAR(100),
+	commission_total FLOAT,
+	status VARCHAR(20),
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(seller_id) REFERENCES user (id)
+);
+
+CREATE TABLE feedback (
+	id INTEGER NOT NULL,
+	buyer_id INTEGER NOT NULL,
+	rating INTEGER NOT NULL,
+	message TEXT NOT NULL,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(buyer_id) REFERENCES user (id) ON DELETE CASCADE
+);
+
+CREATE TABLE product_review (
+	id INTEGER NOT NULL,
+	product_id INTEGER NOT NULL,
+	buyer_id INTEGER NOT NULL,
+	rating INTEGER NOT NULL,
+	review_text TEXT,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(product_id) REFERENCES product (id) ON DELETE CASCADE,
+	FOREIGN KEY(buyer_id) REFERENCES user (id) ON DELETE CASCADE
+);
+
+CREATE TABLE cart (
+	id INTEGER NOT NULL,
+	buyer_id INTEGER NOT NULL,
+	product_id INTEGER NOT NULL,
+	quantity INTEGER NOT NULL,
+	PRIMARY KEY (id),
+	FOREIGN KEY(buyer_id) REFERENCES user (id) ON DELETE CASCADE,
+	FOREIGN KEY(product_id) REFERENCES product (id) ON DELETE CASCADE
+);
+
+CREATE TABLE order_item (
+	id INTEGER NOT NULL,
+	order_id INTEGER NOT NULL,
+	product_id INTEGER,
+	seller_id INTEGER,
+	product_name VARCHAR(100) NOT NULL,
+	price FLOAT NOT NULL,
+	quantity INTEGER NOT NULL,
+	is_paid_to_seller BOOLEAN,
+	commission_amount FLOAT,
+	PRIMARY KEY (id),
+	FOREIGN KEY(order_id) REFERENCES "order" (id) ON DELETE CASCADE,
+	FOREIGN KEY(product_id) REFERENCES product (id) ON DELETE SET NULL
+);
+
+CREATE TABLE order_status_history (
+	id INTEGER NOT NULL,
+	order_id INTEGER NOT NULL,
+	status VARCHAR(50) NOT NULL,
+	timestamp DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(order_id) REFERENCES "order" (id) ON DELETE CASCADE
+);
+
+CREATE TABLE order_note (
+	id INTEGER NOT NULL,
+	order_id INTEGER NOT NULL,
+	author_id INTEGER NOT NULL,
+	note_text TEXT NOT NULL,
+	is_public BOOLEAN NOT NULL,
+	created_at DATETIME,
+	updated_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(order_id) REFERENCES "order" (id) ON DELETE CASCADE,
+	FOREIGN KEY(author_id) REFERENCES user (id)
+);
@@ -0,0 +1,69 @@
+"""Shared fixtures: app.py is imported once against a throwaway SQLite file, which
+each test starts from empty (empty_db) or fully migrated (migrated_db)."""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='emanddi-tests-'), 'test.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+os.environ['NOTIFICATION_TRANSPORT'] = 'fake'
+sys.path.insert(0, APP_DIR)
+
+import app as emanddi  # noqa: E402
+
+emanddi.app.config['TESTING'] = True
+
+
+def reset_process_caches():
+    emanddi._page_totals['counts'].clear()
+    emanddi._admin_header_stats_cache.update(value=None, expires_at=0.0)
+    emanddi._site_settings.update(values=None, version=None, checked_at=0.0)
+    emanddi._cart_summaries['summaries'].clear()
+    emanddi._upi_qr_cache['images'].clear()
+
+
+def add_user(role, **fields):
+    user = emanddi.User(name=fields.pop('name', role.title()), email=fields.pop('email', f'{uuid.uuid4().hex}@test'),
+                        password='x', role=role, **fields)
+    emanddi.db.session.add(user)
+    emanddi.db.session.commit()
+    return user
+
+
+def add_product(seller, **fields):
+    fields = {'name': 'Apple', 'category': 'fruits', 'price': 50.0, 'quantity': 10, **fields}
+    product = emanddi.Product(seller_id=seller.id, **fields)
+    emanddi.db.session.add(product)
+    emanddi.db.session.commit()
+    return product
+
+
+def login(client, user):
+    with client.session_transaction() as session:
+        session['user_id'] = user.id
+        session['user_role'] = user.role
+
+
+@pytest.fixture
+def empty_db():
+    """An app context on a database file with no tables."""
+    reset_process_caches()
+    with emanddi.app.app_context():
+        emanddi.db.session.remove()
+        emanddi.db.engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    with emanddi.app.app_context():
+        yield emanddi
+        emanddi.db.session.remove()
+
+
+@pytest.fixture
+def migrated_db(empty_db):
+    empty_db.run_migrations()
+    return empty_db
@@ -0,0 +1,33 @@
+from conftest import add_product, add_user, login
+
+
+def test_shipping_quote_uses_current_prices(migrated_db):
+    app = migrated_db
+    db = app.db
+    seller, buyer = add_user('seller'), add_user('buyer')
+    product = add_product(seller, price=100.0)
+    app.apply_cart_batch(buyer.id, {product.id: 2})
+    db.session.commit()
+    client = app.app.test_client()
+    login(client, buyer)
+    assert app.cart_summary(buyer.id).subtotal == 200  # cached for the navbar
+
+    db.session.execute(db.update(app.Product).where(app.Product.id == product.id).values(price=400.0))
+    db.session.commit()
+    quote = client.post('/api/calculate_shipping', json={'distance': 3}).get_json()
+
+    assert quote['grand_total'] == 800  # over the free shipping threshold
+
+
+def test_cart_totals_skip_lines_for_deleted_products(migrated_db):
+    app = migrated_db
+    db = app.db
+    seller, buyer = add_user('seller'), add_user('buyer')
+    kept, deleted = add_product(seller, price=10.0), add_product(seller, name='Pear', price=20.0)
+    app.apply_cart_batch(buyer.id, {kept.id: 1, deleted.id: 3})
+    db.session.commit()
+
+    db.session.execute(db.delete(app.Product).where(app.Product.id == deleted.id))
+    db.session.commit()
+
+    assert tuple(app.cart_totals(buyer.id)) == (1, 1, 10)
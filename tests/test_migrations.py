@@ -0,0 +1,54 @@
+import os
+import sqlite3
+from datetime import datetime
+
+from conftest import DB_PATH
+
+BASELINE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_schema.sql')
+
+
+def create_baseline_database():
+    """A database as the pre-migration app left it: v1 tables, a seller, a buyer and one paid order."""
+    with open(BASELINE_SCHEMA) as f:
+        schema = f.read()
+    connection = sqlite3.connect(DB_PATH)
+    connection.executescript(schema)
+    now = datetime(2026, 1, 5, 10, 0).isoformat(' ')
+    connection.executemany('INSERT INTO user (id, name, email, password, role, created_at, is_approved) '
+                           'VALUES (?, ?, ?, ?, ?, ?, 1)',
+                           [(1, 'Seller', 'seller@x', 'x', 'seller', now), (2, 'Buyer', 'buyer@x', 'x', 'buyer', now)])
+    connection.execute("INSERT INTO product (id, name, category, price, quantity, unit, seller_id, created_at) "
+                       "VALUES (1, 'Apple', 'Fruits', 50, 10, 'kg', 1, ?)", (now,))
+    connection.execute("INSERT INTO \"order\" (id, buyer_id, total_amount, payment_mode, status, delivery_fee, "
+                       "delivery_cost, created_at) VALUES (1, 2, 160, 'COD', 'Delivered', 60, 45, ?)", (now,))
+    connection.execute("INSERT INTO order_item (id, order_id, product_id, seller_id, product_name, price, quantity, "
+                       "is_paid_to_seller, commission_amount) VALUES (1, 1, 1, 1, 'Apple', 50, 2, 0, 10)")
+    connection.commit()
+    connection.close()
+
+
+def test_baseline_database_migrates_to_latest(empty_db):
+    app = empty_db
+    db = app.db
+    create_baseline_database()
+
+    applied = app.run_migrations()
+
+    assert applied == [func.__name__ for func in app.MIGRATIONS]
+    assert app.read_schema_state() == app.LATEST_SCHEMA_VERSION
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        assert {column.name for column in table.columns} <= columns, table.name
+
+    admin = db.session.execute(db.select(app.User).where(app.User.role == 'admin')).scalar_one()
+    assert admin.cart_version == 0
+    assert db.session.get(app.OrderItem, 1).category == 'Fruits'
+    rollup = db.session.execute(db.select(app.DailySalesRollup.items_sold, app.DailySalesRollup.item_sales)
+                                .where(app.DailySalesRollup.category_group == 'produce')).one()
+    assert tuple(rollup) == (2, 100)
+
+
+def test_fresh_database_migrates_to_latest(empty_db):
+    assert empty_db.run_migrations() == [func.__name__ for func in empty_db.MIGRATIONS]
+    assert empty_db.run_migrations() == []
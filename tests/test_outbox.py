@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+class StubTransport:
+    """Fails the first `failures` sends to each recipient, then delivers."""
+    def __init__(self, failures=0, error=None):
+        self.failures = failures
+        self.error = error
+        self.calls = []
+
+    def send(self, message):
+        self.calls.append(message.recipient)
+        if self.calls.count(message.recipient) <= self.failures:
+            if self.error:
+                raise self.error
+            return False
+        return True
+
+
+class FailingBatchTransport:
+    def send_batch(self, messages):
+        raise ConnectionError('smtp down')
+
+
+def make_due(app, message):
+    """Moves a rescheduled message's retry time into the past."""
+    message.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    app.db.session.commit()
+
+
+@pytest.fixture
+def outbox(migrated_db):
+    return migrated_db
+
+
+def test_queued_message_is_delivered(outbox):
+    message = outbox.queue_sms('+911234567890', 'Order #1 placed')
+    assert (message.status, message.attempts) == ('pending', 0)
+    transport = StubTransport()
+
+    assert outbox.dispatch_outbox(transport=transport) == 1
+
+    assert transport.calls == ['+911234567890']
+    assert (message.status, message.attempts, message.claim_token, message.last_error) == ('sent', 1, None, None)
+    assert message.sent_at is not None
+    assert outbox.dispatch_outbox(transport=transport) == 0
+
+
+def test_uncommitted_message_is_not_sent(outbox):
+    outbox.queue_email('buyer@test', 'Hi', 'Body', commit=False)
+    outbox.db.session.rollback()
+
+    assert outbox.dispatch_outbox(transport=StubTransport()) == 0
+
+
+def test_failure_is_retried_with_exponential_backoff(outbox):
+    message = outbox.queue_sms('+911234567890', 'Retry me')
+    transport = StubTransport(failures=2, error=TimeoutError('twilio timeout'))
+
+    before = datetime.utcnow()
+    outbox.dispatch_outbox(transport=transport)
+    assert (message.status, message.attempts, message.last_error) == ('pending', 1, 'twilio timeout')
+    first_delay = (message.next_attempt_at - before).total_seconds()
+    assert outbox.NOTIFICATION_RETRY_BASE_SECONDS <= first_delay < outbox.NOTIFICATION_RETRY_BASE_SECONDS + 5
+    assert outbox.dispatch_outbox(transport=transport) == 0  # not due yet
+
+    make_due(outbox, message)
+    before = datetime.utcnow()
+    outbox.dispatch_outbox(transport=transport)
+    assert (message.status, message.attempts) == ('pending', 2)
+    second_delay = (message.next_attempt_at - before).total_seconds()
+    assert 2 * outbox.NOTIFICATION_RETRY_BASE_SECONDS <= second_delay < 2 * outbox.NOTIFICATION_RETRY_BASE_SECONDS + 5
+
+    make_due(outbox, message)
+    outbox.dispatch_outbox(transport=transport)
+    assert (message.status, message.attempts, message.last_error) == ('sent', 3, None)
+
+
+def test_message_is_dead_lettered_after_max_attempts(outbox):
+    message = outbox.queue_sms('+911234567890', 'Never arrives')
+    transport = StubTransport(failures=outbox.NOTIFICATION_MAX_ATTEMPTS + 1)
+
+    for attempt in range(1, outbox.NOTIFICATION_MAX_ATTEMPTS + 1):
+        make_due(outbox, message)
+        assert outbox.dispatch_outbox(transport=transport) == 1
+        assert message.attempts == attempt
+
+    assert (message.status, message.last_error) == ('failed', 'Transport reported failure')
+    make_due(outbox, message)
+    assert outbox.dispatch_outbox(transport=transport) == 0
+    assert len(transport.calls) == outbox.NOTIFICATION_MAX_ATTEMPTS
+
+
+def test_claimed_batch_is_leased_to_one_dispatcher(outbox):
+    first = outbox.queue_sms('+911111111111', 'one')
+    outbox.queue_sms('+922222222222', 'two')
+
+    claimed = outbox._claim_outbox_batch(1)
+    assert [m.id for m in claimed] == [first.id]
+    assert claimed[0].claim_token is not None
+    assert claimed[0].next_attempt_at > datetime.utcnow() + timedelta(seconds=outbox.NOTIFICATION_CLAIM_SECONDS - 5)
+
+    # A second dispatcher skips the leased message; a crashed lease is retried once it runs out
+    assert [m.recipient for m in outbox._claim_outbox_batch(10)] == ['+922222222222']
+
+
+def test_failed_batch_send_reschedules_every_message(outbox):
+    messages = [outbox.queue_email(f'buyer{i}@test', 'Offer', 'Body') for i in range(3)]
+
+    assert outbox.dispatch_outbox(transport=FailingBatchTransport()) == 3
+
+    assert [(m.status, m.attempts, m.last_error) for m in messages] == [('pending', 1, 'smtp down')] * 3
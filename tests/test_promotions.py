@@ -0,0 +1,74 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import add_user
+
+
+class RecordingThread(threading.Thread):
+    """Records campaign runner threads instead of starting them; sender pool threads run."""
+    started = []
+
+    def start(self):
+        if self.name.startswith('promotion-'):
+            RecordingThread.started.append(self._args[0])
+        else:
+            super().start()
+
+
+@pytest.fixture
+def promotions(migrated_db, monkeypatch):
+    RecordingThread.started = []
+    monkeypatch.setattr(migrated_db.threading, 'Thread', RecordingThread)
+    for i in range(3):
+        add_user('buyer', email=f'buyer{i}@test')
+    return migrated_db
+
+
+def add_campaign(app, **fields):
+    campaign = app.PromotionCampaign(message='Hi {name}', subject='Offers', channels='email', **fields)
+    app.db.session.add(campaign)
+    app.db.session.commit()
+    return campaign
+
+
+def test_queued_campaign_starts_one_runner(promotions):
+    campaign = add_campaign(promotions)
+
+    # Every worker's dispatcher resumes campaigns; only the first claim starts a runner
+    assert promotions.resume_promotion_campaigns() == 1
+    assert promotions.resume_promotion_campaigns() == 0
+
+    assert RecordingThread.started == [campaign.id]
+    promotions.db.session.refresh(campaign)
+    assert campaign.status == 'running'
+
+
+def test_stale_campaign_is_resumed_from_its_cursor(promotions):
+    first_buyer = promotions.db.session.scalar(promotions.db.select(promotions.db.func.min(promotions.User.id))
+                                               .where(promotions.User.role == 'buyer'))
+    long_ago = datetime.utcnow() - timedelta(seconds=promotions.PROMOTION_STALE_SECONDS + 60)
+    stale = add_campaign(promotions, status='running', started_at=long_ago, heartbeat_at=long_ago,
+                         last_user_id=first_buyer, sent_count=1)
+    live = add_campaign(promotions, status='running', started_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())
+
+    assert promotions.resume_promotion_campaigns() == 1
+    assert RecordingThread.started == [stale.id]
+
+    transport = promotions.FakeTransport()
+    promotions.run_promotion_campaign(stale.id, transport=transport, claimed=True)
+    promotions.db.session.refresh(live)
+    assert (stale.status, stale.sent_count) == ('completed', 3)
+    assert len(transport.sent) == 2  # the first buyer was sent before the runner died
+    assert live.status == 'running'
+
+
+def test_running_campaign_is_not_run_twice(promotions):
+    campaign = add_campaign(promotions, status='running', started_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())
+    transport = promotions.FakeTransport()
+
+    promotions.run_promotion_campaign(campaign.id, transport=transport)
+
+    assert transport.sent == []
+    assert campaign.status == 'running'
@@ -0,0 +1,35 @@
+from conftest import add_user
+
+
+class FailingPayments:
+    def refund(self, payment_id, data):
+        raise RuntimeError('refund API down')
+
+
+class FailingRefundRazorpay:
+    payment = FailingPayments()
+
+
+def rollup_rows(app):
+    table = app.DailySalesRollup
+    return app.db.session.execute(
+        app.db.select(table.day, table.category_group, table.order_count, table.total_amount,
+                      table.item_sales, table.items_sold).order_by(table.day, table.category_group)
+    ).all()
+
+
+def test_payment_review_order_matches_a_rebuild(migrated_db, monkeypatch):
+    app = migrated_db
+    buyer = add_user('buyer')
+    monkeypatch.setattr(app, 'razorpay_client', app.LazyProvider(FailingRefundRazorpay))
+
+    assert app.refund_unfulfilled_payment(buyer.id, 'pay_1', 250.0, 'Farm road', 'sold out') is False
+
+    order = app.db.session.execute(app.db.select(app.Order).where(app.Order.buyer_id == buyer.id)).scalar_one()
+    assert order.status == 'Payment Review'
+    incremental = rollup_rows(app)
+    assert [(row.category_group, row.order_count, row.total_amount) for row in incremental] == [('all', 1, 250.0)]
+
+    app.rebuild_daily_sales_rollup()
+    app.db.session.commit()
+    assert rollup_rows(app) == incremental
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import add_product, add_user, login
+
+
+class FailingOrders:
+    def create(self, data):
+        raise RuntimeError('gateway timeout')
+
+
+class FailingRazorpay:
+    order = FailingOrders()
+
+
+def hold(app, buyer, product, quantity, minutes):
+    """Takes `quantity` of the product into a hold expiring in `minutes` (negative: already expired)."""
+    app.hold_cart_stock(buyer.id, [{'id': product.id, 'quantity': quantity}])
+    app.db.session.execute(app.db.update(app.StockHold).values(expires_at=datetime.utcnow() + timedelta(minutes=minutes)))
+    app.db.session.commit()
+
+
+@pytest.fixture
+def shop(migrated_db):
+    seller = add_user('seller')
+    product = add_product(seller, quantity=2)
+    return migrated_db, product, add_user('buyer'), add_user('buyer')
+
+
+def test_add_to_cart_reclaims_expired_holds(shop):
+    app, product, abandoned, buyer = shop
+    hold(app, abandoned, product, 2, minutes=-1)
+    client = app.app.test_client()
+    login(client, buyer)
+
+    response = client.get(f'/add_to_cart/{product.id}')
+
+    assert response.get_json()['success'] is True
+    assert app.db.session.scalar(app.db.select(app.db.func.count(app.StockHold.id))) == 0
+    assert app.db.session.get(app.Product, product.id).quantity == 2
+
+
+def test_add_to_cart_respects_live_holds(shop):
+    app, product, paying, buyer = shop
+    hold(app, paying, product, 2, minutes=5)
+    client = app.app.test_client()
+    login(client, buyer)
+
+    response = client.get(f'/add_to_cart/{product.id}')
+
+    assert response.status_code == 400
+    assert app.db.session.get(app.Product, product.id).quantity == 0
+
+
+def test_cart_batch_reclaims_expired_holds(shop):
+    app, product, abandoned, buyer = shop
+    hold(app, abandoned, product, 2, minutes=-1)
+
+    app.apply_cart_batch(buyer.id, {product.id: 2})
+    app.db.session.commit()
+
+    assert app.db.session.scalar(app.db.select(app.Cart.quantity).where(app.Cart.buyer_id == buyer.id)) == 2
+
+
+def test_failed_gateway_order_releases_the_hold(shop, monkeypatch):
+    app, product, _, buyer = shop
+    monkeypatch.setattr(app, 'RAZORPAY_KEY_ID', 'key')
+    monkeypatch.setattr(app, 'RAZORPAY_KEY_SECRET', 'secret')
+    monkeypatch.setattr(app, 'razorpay_client', app.LazyProvider(FailingRazorpay))
+    app.apply_cart_batch(buyer.id, {product.id: 2})
+    app.db.session.commit()
+    client = app.app.test_client()
+    login(client, buyer)
+
+    response = client.post('/create-payment', json={'distance': 3})
+
+    assert response.status_code == 400
+    app.db.session.expire_all()
+    assert app.db.session.get(app.Product, product.id).quantity == 2
+    assert app.db.session.scalar(app.db.select(app.db.func.count(app.StockHold.id))) == 0